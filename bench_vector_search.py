@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""Latency benchmark for the learnings/schema searches (live MindsDB and Gemini calls)
+
+Run directly: python bench_vector_search.py
+"""
+
+import time
+import numpy as np
+from src.vector_store import get_vector_store
+from src.learnings_index import LearningsIndex
+
+ITERATIONS = 1000
+QUERY = "revenue sales amount payment"
+
+def time_calls(label, search):
+    """Time ITERATIONS calls of search() and print p50/p95/p99 latency"""
+    timings_ns = []
+    errors = 0
+    for _ in range(ITERATIONS):
+        start = time.perf_counter_ns()
+        try:
+            search()
+        except Exception as e:
+            errors += 1
+            if errors == 1:
+                print(f"Error during {label} search: {e}")
+            continue
+        timings_ns.append(time.perf_counter_ns() - start)
+
+    if not timings_ns:
+        print(f"All {label} searches failed")
+        return
+    p50, p95, p99 = np.percentile(np.array(timings_ns) / 1e6, [50, 95, 99])
+    print(f"{label}: {len(timings_ns)} searches ({errors} failed): "
+          f"p50 {p50:.1f} ms, p95 {p95:.1f} ms, p99 {p99:.1f} ms")
+
+def benchmark_search():
+    vs = get_vector_store()
+    verbose = vs.verbose
+    # Quiet store: per-call prints would dominate the timings
+    vs.verbose = False
+    try:
+        # Warm-up call connects to MindsDB and shows what a search returns
+        results = vs.search(QUERY, top_k=5)
+        print(f"Number of results: {len(results)}")
+        for i, result in enumerate(results):
+            print(f"{i+1}. {result}")
+        time_calls("MindsDB", lambda: vs.search(QUERY, top_k=5))
+    finally:
+        vs.verbose = verbose
+
+    # The local index answers learnings lookups before MindsDB is asked.
+    # The warm-up embeds any titles not saved by update_learnings_kb.py and
+    # caches the query embedding, so the loop times the scan itself.
+    index = LearningsIndex.create()
+    print(f"\nLocal learnings index: {len(index.blocks)} learnings, "
+          f"first search returned {len(index.search(QUERY, top_k=5))} results")
+    time_calls("Local learnings", lambda: index.search(QUERY, top_k=5))
+
+if __name__ == "__main__":
+    benchmark_search()
@@ -12,13 +12,11 @@ import logging
 
 # Configuration
 MAX_WORKERS = 3  # Number of parallel workers for AI enrichment
+METADATA_WORKERS = 8  # Number of tables extracted from ClickHouse in parallel
 
 # Add src directory to Python path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src'))
 
-from generate_ch_metadata import get_comprehensive_database_metadata, client, database
-from metadata_generator import MetadataEnricher
-
 def setup_logging(verbose=False):
     """Setup logging configuration"""
     level = logging.DEBUG if verbose else logging.INFO
@@ -88,14 +86,19 @@ Examples:
         
         # Step 1: Run metadata extraction if requested
         if args.metadata:
+            # Imported here: the module connects to ClickHouse on import
+            from generate_ch_metadata import get_comprehensive_database_metadata, client, create_client, database
+            
             logger.info("🎯 Starting metadata extraction")
-            df_metadata = get_comprehensive_database_metadata(
+            records_written = get_comprehensive_database_metadata(
                 client=client, 
                 database=database,
                 output_file=basic_output_file,
-                test_mode=args.test_mode
+                test_mode=args.test_mode,
+                max_workers=METADATA_WORKERS,
+                client_factory=create_client
             )
-            logger.info("🎉 Extraction completed")
+            logger.info(f"🎉 Extraction completed ({records_written} records)")
             logger.info(f"📄 Output file: {basic_output_file}")
         
         # Step 2: Run enrichment if requested
@@ -111,6 +114,8 @@ Examples:
                 logger.error("❌ GOOGLE_API_KEY not found in environment variables")
                 sys.exit(1)
             
+            from metadata_generator import MetadataEnricher
+            
             logger.info("🤖 Starting AI enrichment")
             enricher = MetadataEnricher()
             
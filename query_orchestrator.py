@@ -4,25 +4,40 @@ ClickHouse Query Processing Orchestrator
 Simple CLI driver for running the query processing system.
 """
 import argparse
+import atexit
 import sys
 import os
 import logging
+import re
 import warnings
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+try:
+    import readline  # Line editing/history for the REPL; not available on all platforms
+except ImportError:
+    readline = None
+
+# Configuration
+MAX_DUPLICATE_RETRIES = 2  # Extra attempts when regenerate returns an already-tried query
+HISTORY_FILE = os.path.expanduser('~/.clickhouse_nl2sql_history')
+
+_WS_RE = re.compile(r'\s+')
+_EXIT_CMDS = frozenset({'exit', 'quit'})
+
+# Runs safety checks in the background while the user reviews the SQL
+_EXECUTOR = ThreadPoolExecutor(max_workers=2)
 
 # Suppress Google Cloud SDK authentication warnings
 warnings.filterwarnings("ignore", message="Your application has authenticated using end user credentials")
 warnings.filterwarnings("ignore", category=UserWarning, module="google.auth._default")
 
-# Suppress LiteLLM verbose logging
-logging.getLogger("LiteLLM").setLevel(logging.WARNING)
-logging.getLogger("litellm").setLevel(logging.WARNING)
+# Third-party loggers silenced in interactive mode
+_QUIET_LOGGERS = ('LiteLLM', 'litellm', 'httpx', 'openai', 'anthropic', 'google.auth._default')
 
 # Add src directory to Python path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src'))
 
-from src.vector_store import VectorStore
-from src.query_processor import QueryProcessor
-from src.sql_executor import SQLExecutor
 from src.config import Config
 
 def setup_logging(verbose=False, interactive=False):
@@ -36,7 +51,7 @@ def setup_logging(verbose=False, interactive=False):
         )
         # Suppress all third-party loggers
         logging.getLogger().setLevel(logging.CRITICAL)
-        for logger_name in ['LiteLLM', 'litellm', 'httpx', 'openai', 'anthropic']:
+        for logger_name in _QUIET_LOGGERS:
             logging.getLogger(logger_name).setLevel(logging.CRITICAL)
     else:
         level = logging.DEBUG if verbose else logging.INFO
@@ -45,6 +60,279 @@ def setup_logging(verbose=False, interactive=False):
             format='%(asctime)s - %(levelname)s - %(message)s'
         )
 
+def _ask(prompt: str) -> str:
+    """Prompt the user and return the answer stripped and lowercased"""
+    return input(prompt).strip().lower()
+
+def _exit_command(query_processor) -> bool:
+    """Leave the REPL"""
+    print("👋 Goodbye!")
+    return False
+
+def _history_command(query_processor) -> bool:
+    """Show conversation history"""
+    query_processor.show_conversation_history()
+    return True
+
+def _help_command(query_processor) -> bool:
+    """Show available commands"""
+    print("\n📖 Available commands:")
+    print("  • Type natural language questions about your data")
+    print("  • 'history' - Show conversation history")
+    print("  • 'clear' - Clear conversation history")
+    print("  • 'exit' or 'quit' - Exit the assistant")
+    return True
+
+def _clear_command(query_processor) -> bool:
+    """Clear conversation history"""
+    query_processor.clear_conversation_history()
+    print("🧹 Conversation history cleared!")
+    return True
+
+# REPL commands; handlers return False to stop the loop
+COMMANDS = {
+    **dict.fromkeys(_EXIT_CMDS, _exit_command),
+    'history': _history_command,
+    'help': _help_command,
+    'clear': _clear_command,
+}
+
+def _make_completer(commands):
+    """Tab-complete REPL commands"""
+    options = sorted(commands)
+    
+    def completer(text, state):
+        matches = [cmd for cmd in options if cmd.startswith(text.lower())]
+        return matches[state] if state < len(matches) else None
+    
+    return completer
+
+def _setup_readline() -> None:
+    """Enable input history and command completion when readline is available"""
+    if readline is None:
+        return
+    readline.set_completer(_make_completer(COMMANDS))
+    readline.parse_and_bind('tab: complete')
+    try:
+        readline.read_history_file(HISTORY_FILE)
+    except OSError:
+        pass  # First run, no history yet
+    atexit.register(readline.write_history_file, HISTORY_FILE)
+
+def _session_context(query_processor, session) -> str:
+    """Schema context for the session's query, retrieved once per top-level question"""
+    if session['context'] is None:
+        session['context'] = query_processor.retrieve_relevant_context(session['user_query'])
+    return session['context']
+
+def _norm_sql(sql_query: str) -> str:
+    """Normalize SQL for duplicate detection (whitespace, trailing semicolon, case)"""
+    return _WS_RE.sub(' ', sql_query.strip().rstrip(';')).lower()
+
+def _record_query(session, sql_query: str) -> bool:
+    """Remember a generated SQL in try order; returns False if it was already tried"""
+    key = _norm_sql(sql_query)
+    if key in session['tried_keys']:
+        return False
+    session['tried_keys'].add(key)
+    session['tried_queries'].append(sql_query.strip())
+    session['failures'].append(f"Failed Query {len(session['tried_queries'])}: {sql_query.strip()}")
+    return True
+
+def _start_safety_check(query_processor, session) -> None:
+    """Check the session's current SQL in the background, dropping any stale check"""
+    if session.get('safety') is not None:
+        session['safety'].cancel()
+    session['safety'] = _EXECUTOR.submit(query_processor.check_sql_safety, session['sql_query'])
+
+def _approve_sql(query_processor, session):
+    """Accept the current SQL"""
+    return True
+
+def _cancel_sql(query_processor, session):
+    """Drop the current SQL"""
+    print("❌ Query cancelled.")
+    return False
+
+def _modify_sql(query_processor, session):
+    """Apply a targeted modification to the current SQL"""
+    user_query = session['user_query']
+    sql_query = session['sql_query']
+    
+    # Get specific modification feedback with better prompts
+    print("\n🔧 What type of modification do you need?")
+    print("  Examples:")
+    print("  • 'Add a filter for status = active'")
+    print("  • 'Group by month instead of day'") 
+    print("  • 'Include product names in the results'")
+    print("  • 'Sort by revenue descending'")
+    
+    modification = input("\n💭 Describe the modification: ").strip()
+    if not modification:
+        print("❌ No modification specified.")
+        return None
+    
+    print(f"🔄 Modifying query: {modification}")
+    
+    # MODIFY context: Keep original query as base, add modification
+    context = _session_context(query_processor, session)
+    
+    # Create modification-specific prompt
+    modification_query = f"""
+Original request: {user_query}
+
+Current SQL that needs modification:
+{sql_query}
+
+MODIFICATION NEEDED: {modification}
+
+Please modify the above SQL query to incorporate the requested change. Keep the core logic the same but apply the modification.
+"""
+    
+    rephrased = query_processor.rephrase_query(modification_query, context)
+    
+    # Generate modified SQL with specific context
+    modification_context = f"""
+TASK: MODIFY existing SQL query
+Original SQL: {sql_query}
+Modification requested: {modification}
+
+{context}
+
+Instructions: Take the existing SQL and apply ONLY the requested modification. Do not completely rewrite the query.
+"""
+    
+    new_sql = query_processor.generate_sql(
+        rephrased, modification_context, f"MODIFY: {modification}", ""
+    )
+    
+    session['sql_query'] = new_sql
+    _record_query(session, new_sql)
+    _start_safety_check(query_processor, session)
+    
+    # Store the modification learning immediately
+    query_processor.add_to_conversation_history(
+        user_query, new_sql, f"User requested modification: {modification}", False
+    )
+    return None
+
+def _regenerate_sql(query_processor, session):
+    """Generate a different approach, avoiding the SQL tried so far"""
+    user_query = session['user_query']
+    sql_query = session['sql_query']
+    
+    # Get regeneration feedback with different prompts
+    print("\n🔄 Why do you want to regenerate?")
+    print("  Examples:")
+    print("  • 'This approach is completely wrong'")
+    print("  • 'Need a different table/approach'")
+    print("  • 'Missing key business logic'")
+    print("  • 'Wrong aggregation method'")
+    
+    regeneration_reason = input("\n💭 What's wrong with this approach? ").strip()
+    if not regeneration_reason:
+        print("❌ No regeneration reason provided.")
+        return None
+    
+    print(f"🔄 Regenerating from scratch: {regeneration_reason}")
+    
+    # REGENERATE context: Start fresh, avoid previous approach
+    context = _session_context(query_processor, session)
+    
+    # Create regeneration-specific prompt
+    regeneration_query = f"""
+Original request: {user_query}
+
+FAILED APPROACH that should be AVOIDED:
+{sql_query}
+
+PROBLEM WITH FAILED APPROACH: {regeneration_reason}
+
+Please generate a COMPLETELY DIFFERENT SQL approach to solve this request. Do not use the same tables, joins, or logic as the failed approach above.
+"""
+    
+    rephrased = query_processor.rephrase_query(regeneration_query, context)
+    
+    # Generate new SQL with regeneration context
+    regeneration_context = f"""
+TASK: COMPLETELY REGENERATE SQL query
+Failed approach to avoid: {sql_query}
+Reason for failure: {regeneration_reason}
+
+{context}
+
+Instructions: Generate a COMPLETELY DIFFERENT approach. Use different tables, different joins, different logic. Avoid the patterns from the failed query.
+"""
+    
+    previous_failures = "\n".join(session['failures'])
+    
+    for attempt in range(MAX_DUPLICATE_RETRIES + 1):
+        new_sql = query_processor.generate_sql(
+            rephrased, regeneration_context, f"REGENERATE: {regeneration_reason}", previous_failures
+        )
+        if _record_query(session, new_sql):
+            break
+        # Same SQL as an earlier attempt - call it out explicitly and retry
+        previous_failures += f"\nFORBIDDEN (already generated, do NOT return this again): {new_sql.strip()}"
+    else:
+        print("⚠️  Could not generate a different query. Try giving a more specific reason.")
+        return None
+    
+    session['sql_query'] = new_sql
+    _start_safety_check(query_processor, session)
+    
+    # Store the regeneration learning immediately
+    query_processor.add_to_conversation_history(
+        user_query, new_sql, f"Previous approach failed: {regeneration_reason}", False
+    )
+    return None
+
+def _print_rows(rows, limit=None) -> None:
+    """Print result rows as a numbered list in a single write"""
+    out = "\n".join(f"  {i}. {row}" for i, row in enumerate(islice(rows, limit), 1))
+    sys.stdout.write(out + "\n")
+    sys.stdout.flush()
+
+def _execute_and_display(sql_executor, query_processor, user_query: str, sql_query: str) -> None:
+    """Run an approved query, show a preview of the rows and store it as a learning"""
+    # Preview first so large results don't cross the wire unless asked for
+    query_result = sql_executor.execute_query(sql_query, preview=True)
+    
+    if query_result:
+        row_count = len(query_result)
+        if row_count > Config.PREVIEW_ROWS:
+            row_count = None  # Unknown until the full result is fetched
+            print(f"\n📊 Results (first {Config.PREVIEW_ROWS} rows):")
+            _print_rows(query_result, Config.PREVIEW_ROWS)
+            fetch_all = _ask("\n📥 More rows available. Fetch all? (yes/no): ")
+            if fetch_all == 'yes':
+                query_result = sql_executor.execute_query(sql_query) or query_result
+                row_count = len(query_result)
+                print(f"\n📊 Results ({row_count} rows):")
+                _print_rows(query_result)
+        else:
+            print(f"\n📊 Results ({len(query_result)} rows):")
+            _print_rows(query_result)
+        
+        # Auto-store successful query (user already approved it pre-execution)
+        print("✅ Query executed successfully! Storing for future reference.")
+        query_processor.store_successful_query(
+            user_query, sql_query, "User approved and executed successfully",
+            query_result[:Config.STORED_RESULT_ROWS], row_count=row_count
+        )
+    elif sql_executor.last_error:
+        print(f"\n❌ Query failed: {sql_executor.last_error}")
+    else:
+        print("\n❌ No results returned")
+
+# Refinement actions; handlers return True (approved), False (cancelled) or None (keep refining)
+REFINE_ACTIONS = {
+    'yes': _approve_sql,
+    'no': _cancel_sql,
+    'modify': _modify_sql,
+    'regenerate': _regenerate_sql,
+}
+
 def main():
     """Main CLI entry point"""
     parser = argparse.ArgumentParser(
@@ -90,6 +378,11 @@ Examples:
             parser.print_help()
             sys.exit(1)
         
+        from src.vector_store import VectorStore
+        
+        # One MindsDB client for both steps; KB creation alone keeps its progress output
+        vector_store = VectorStore(verbose=args.verbose or not args.interactive)
+        
         # Step 1: Create knowledge base if requested
         if args.create_kb:
             if not os.path.exists(Config.METADATA_FILE):
@@ -98,7 +391,6 @@ Examples:
                 sys.exit(1)
             
             logger.info("🧠 Creating knowledge base")
-            vector_store = VectorStore()
             vector_store.create_knowledge_base()
             
             # Also create learnings knowledge base if learnings exist
@@ -116,31 +408,25 @@ Examples:
             else:
                 logger.info("🚀 Starting interactive query mode")
             
-            query_processor = QueryProcessor(verbose=args.verbose)
+            from src.query_processor import QueryProcessor
+            from src.sql_executor import SQLExecutor
+            from src.dspy_modules import get_lm
+            
+            query_processor = QueryProcessor(verbose=args.verbose, vector_store=vector_store)
             sql_executor = SQLExecutor()
             
+            # Build the LM up front so the first question doesn't pay for it
+            get_lm()
+            _setup_readline()
+            
             while True:
                 try:
                     user_query = input("\n💬 ")
-                    if user_query.lower() in ['exit', 'quit']:
-                        print("👋 Goodbye!")
-                        break
-                    
-                    if user_query.lower() == 'history':
-                        query_processor.show_conversation_history()
-                        continue
-                    
-                    if user_query.lower() == 'help':
-                        print("\n📖 Available commands:")
-                        print("  • Type natural language questions about your data")
-                        print("  • 'history' - Show conversation history")
-                        print("  • 'clear' - Clear conversation history")
-                        print("  • 'exit' or 'quit' - Exit the assistant")
-                        continue
-                    
-                    if user_query.lower() == 'clear':
-                        query_processor.conversation_history.clear()
-                        print("🧹 Conversation history cleared!")
+                    cmd = user_query.strip().lower()
+                    command = COMMANDS.get(cmd)
+                    if command:
+                        if not command(query_processor):
+                            break
                         continue
                     
                     # Process the query
@@ -150,179 +436,50 @@ Examples:
                     if result['sql_query']:
                         # Pre-execution refinement loop
                         sql_query = result['sql_query']
-                        user_approved = False
-                        tried_queries = set()  # Track queries we've already tried
-                        tried_queries.add(sql_query.strip())
+                        session = {
+                            'user_query': user_query,
+                            'sql_query': sql_query,
+                            'tried_queries': [],  # Queries we've already tried, in order
+                            'tried_keys': set(),
+                            'failures': [],  # "Failed Query N: ..." lines for regeneration prompts
+                            'context': None,  # Filled on first modify/regenerate
+                            'safety': None,  # Future for the current SQL's safety check
+                        }
+                        _record_query(session, sql_query)
+                        _start_safety_check(query_processor, session)
                         
                         while True:
                             print(f"\n🔍 Generated SQL:")
-                            print(f"```sql\n{sql_query}\n```")
+                            print(f"```sql\n{session['sql_query']}\n```")
                             
-                            refinement = input("\n🤔 Is this what you want? (yes/no/modify/regenerate): ").lower().strip()
+                            refinement = _ask("\n🤔 Is this what you want? (yes/no/modify/regenerate): ")
                             
-                            if refinement == 'yes':
-                                user_approved = True
-                                break
-                            elif refinement == 'no':
-                                print("❌ Query cancelled.")
-                                break
-                            elif refinement == 'modify':
-                                # Get specific modification feedback with better prompts
-                                print("\n🔧 What type of modification do you need?")
-                                print("  Examples:")
-                                print("  • 'Add a filter for status = active'")
-                                print("  • 'Group by month instead of day'") 
-                                print("  • 'Include product names in the results'")
-                                print("  • 'Sort by revenue descending'")
-                                
-                                modification = input("\n💭 Describe the modification: ").strip()
-                                if modification:
-                                    print(f"🔄 Modifying query: {modification}")
-                                    
-                                    # MODIFY context: Keep original query as base, add modification
-                                    context = query_processor.retrieve_relevant_context(user_query)
-                                    
-                                    # Create modification-specific prompt
-                                    modification_query = f"""
-Original request: {user_query}
-
-Current SQL that needs modification:
-{sql_query}
-
-MODIFICATION NEEDED: {modification}
-
-Please modify the above SQL query to incorporate the requested change. Keep the core logic the same but apply the modification.
-"""
-                                    
-                                    rephrased = query_processor.rephrase_query(modification_query, context)
-                                    
-                                    # Generate modified SQL with specific context
-                                    modification_context = f"""
-TASK: MODIFY existing SQL query
-Original SQL: {sql_query}
-Modification requested: {modification}
-
-{context}
-
-Instructions: Take the existing SQL and apply ONLY the requested modification. Do not completely rewrite the query.
-"""
-                                    
-                                    new_sql = query_processor.generate_sql(
-                                        rephrased, modification_context, f"MODIFY: {modification}", ""
-                                    )
-                                    
-                                    sql_query = new_sql
-                                    tried_queries.add(new_sql.strip())
-                                    
-                                    # Store the modification learning immediately
-                                    query_processor.add_to_conversation_history(
-                                        user_query, sql_query, f"User requested modification: {modification}", False
-                                    )
-                                else:
-                                    print("❌ No modification specified.")
-                            elif refinement == 'regenerate':
-                                # Get regeneration feedback with different prompts
-                                print("\n🔄 Why do you want to regenerate?")
-                                print("  Examples:")
-                                print("  • 'This approach is completely wrong'")
-                                print("  • 'Need a different table/approach'")
-                                print("  • 'Missing key business logic'")
-                                print("  • 'Wrong aggregation method'")
-                                
-                                regeneration_reason = input("\n💭 What's wrong with this approach? ").strip()
-                                if regeneration_reason:
-                                    print(f"🔄 Regenerating from scratch: {regeneration_reason}")
-                                    
-                                    # REGENERATE context: Start fresh, avoid previous approach
-                                    context = query_processor.retrieve_relevant_context(user_query)
-                                    
-                                    # Create regeneration-specific prompt
-                                    regeneration_query = f"""
-Original request: {user_query}
-
-FAILED APPROACH that should be AVOIDED:
-{sql_query}
-
-PROBLEM WITH FAILED APPROACH: {regeneration_reason}
-
-Please generate a COMPLETELY DIFFERENT SQL approach to solve this request. Do not use the same tables, joins, or logic as the failed approach above.
-"""
-                                    
-                                    rephrased = query_processor.rephrase_query(regeneration_query, context)
-                                    
-                                    # Generate new SQL with regeneration context
-                                    regeneration_context = f"""
-TASK: COMPLETELY REGENERATE SQL query
-Failed approach to avoid: {sql_query}
-Reason for failure: {regeneration_reason}
-
-{context}
-
-Instructions: Generate a COMPLETELY DIFFERENT approach. Use different tables, different joins, different logic. Avoid the patterns from the failed query.
-"""
-                                    
-                                    previous_failures = "\n".join([f"Failed Query {i+1}: {q}" for i, q in enumerate(tried_queries)])
-                                    
-                                    new_sql = query_processor.generate_sql(
-                                        rephrased, regeneration_context, f"REGENERATE: {regeneration_reason}", previous_failures
-                                    )
-                                    
-                                    sql_query = new_sql
-                                    tried_queries.add(new_sql.strip())
-                                    
-                                    # Store the regeneration learning immediately
-                                    query_processor.add_to_conversation_history(
-                                        user_query, sql_query, f"Previous approach failed: {regeneration_reason}", False
-                                    )
-                                else:
-                                    print("❌ No regeneration reason provided.")
-                            else:
+                            action = REFINE_ACTIONS.get(refinement)
+                            if not action:
                                 print("❓ Please answer 'yes', 'no', 'modify', or 'regenerate'")
+                                continue
+                            
+                            user_approved = action(query_processor, session)
+                            if user_approved is not None:
+                                break
+                        
+                        sql_query = session['sql_query']
                         
                         # Only proceed if user approved the query
-                        if user_approved:
-                            # Now check safety and execute
-                            safety_result = query_processor.check_sql_safety(sql_query)
+                        if not user_approved:
+                            session['safety'].cancel()
+                        else:
+                            # Safety check has been running since the SQL was shown
+                            safety_result = session['safety'].result()
                             
                             if safety_result['is_safe']:
-                                execute = input("\n▶️  Execute this query? (yes/no): ").lower()
-                                if execute == 'yes':
-                                    query_result = sql_executor.execute_query(sql_query)
-                                    
-                                    if query_result:
-                                        print(f"\n📊 Results ({len(query_result)} rows):")
-                                        for i, row in enumerate(query_result[:10]):  # Show first 10 rows
-                                            print(f"  {i+1}. {row}")
-                                        if len(query_result) > 10:
-                                            print(f"  ... and {len(query_result) - 10} more rows")
-                                        
-                                        # Auto-store successful query (user already approved it pre-execution)
-                                        print("✅ Query executed successfully! Storing for future reference.")
-                                        query_processor.store_successful_query(
-                                            user_query, sql_query, "User approved and executed successfully", query_result
-                                        )
-                                    else:
-                                        print("\n❌ No results returned")
+                                execute = _ask("\n▶️  Execute this query? (yes/no): ")
                             else:
                                 print(f"\n⚠️  Safety warning: {safety_result['reason']}")
-                                execute = input("Execute anyway? (yes/no): ").lower()
-                                if execute == 'yes':
-                                    query_result = sql_executor.execute_query(sql_query)
-                                    
-                                    if query_result:
-                                        print(f"\n📊 Results ({len(query_result)} rows):")
-                                        for i, row in enumerate(query_result[:10]):
-                                            print(f"  {i+1}. {row}")
-                                        if len(query_result) > 10:
-                                            print(f"  ... and {len(query_result) - 10} more rows")
-                                        
-                                        # Auto-store successful query (user already approved it pre-execution)
-                                        print("✅ Query executed successfully! Storing for future reference.")
-                                        query_processor.store_successful_query(
-                                            user_query, sql_query, "User approved and executed successfully", query_result
-                                        )
-                                    else:
-                                        print("\n❌ No results returned")
+                                execute = _ask("Execute anyway? (yes/no): ")
+                            
+                            if execute == 'yes':
+                                _execute_and_display(sql_executor, query_processor, user_query, sql_query)
                     else:
                         print(f"\n❌ {result['reason']}")
                         
@@ -334,6 +491,9 @@ Instructions: Generate a COMPLETELY DIFFERENT approach. Use different tables, di
                         print(f"\n❌ Error: {e}")
                     else:
                         print("\n❌ Something went wrong. Try rephrasing your question.")
+            
+            _EXECUTOR.shutdown(wait=False, cancel_futures=True)
+            query_processor.close()
         
     except ImportError as e:
         logger.error(f"❌ Missing dependencies: {e}")
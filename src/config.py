@@ -1,26 +1,40 @@
 # src/config.py
 import os
-from typing import Dict, Any
+from typing import Dict, Any, Optional
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+class ConfigError(ValueError):
+    """Raised when an environment setting is present but invalid"""
+
+def _get_int_env(name: str, default: Optional[int] = None) -> Optional[int]:
+    """Read an integer environment variable, falling back to default when unset"""
+    value = os.getenv(name)
+    if value is None or value.strip() == '':
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise ConfigError(f"{name} must be an integer, got {value!r}") from None
+
 class Config:
     """Configuration settings for the application"""
     
     # MindsDB settings
     MINDSDB_HOST = os.getenv('MINDSDB_HOST')
-    MINDSDB_PORT = int(os.getenv('MINDSDB_PORT'))
+    MINDSDB_PORT = _get_int_env('MINDSDB_PORT', 47334)
     MINDSDB_USER = os.getenv('MINDSDB_USER')
     MINDSDB_PASSWORD = os.getenv('MINDSDB_PASSWORD')
+    MINDSDB_POOL_SIZE = _get_int_env('MINDSDB_POOL_SIZE', 4)  # Connections shared by concurrent searches
     
     # Construct full MindsDB URL
     MINDSDB_URL = f'http://{MINDSDB_HOST}:{MINDSDB_PORT}'
     
     # Gemini API settings
-    GEMINI_API_KEY = os.getenv('GOOGLE_API_KEY')
-    GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')  # Alias for compatibility
+    GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
+    GEMINI_API_KEY = GOOGLE_API_KEY  # Alias for compatibility
     GOOGLE_CLOUD_QUOTA_PROJECT = os.getenv('GOOGLE_CLOUD_QUOTA_PROJECT')
     
     # Knowledge base settings
@@ -41,10 +55,12 @@ class Config:
     # Query processing settings
     CONFIDENCE_THRESHOLD = 0.7
     TOP_K_RESULTS = 10
+    PREVIEW_ROWS = 10  # Rows fetched when previewing an approved query
+    STORED_RESULT_ROWS = 20  # Sample of result rows kept with a successful query
     
     # ClickHouse settings - match .env variable names
     CLICKHOUSE_HOST = os.getenv('ch_host')
-    CLICKHOUSE_PORT = int(os.getenv('ch_port'))
+    CLICKHOUSE_PORT = _get_int_env('ch_port')  # None lets clickhouse-connect pick the default
     CLICKHOUSE_USER = os.getenv('ch_username')
     CLICKHOUSE_PASSWORD = os.getenv('ch_password')
     CLICKHOUSE_DATABASE = os.getenv('ch_database')
@@ -1,26 +1,41 @@
 # src/dspy_modules.py
 import dspy
 import os
+from functools import lru_cache, cached_property
 from src.config import Config
 import google.generativeai as genai
 
-# Configure Google API
-genai.configure(api_key=Config.GEMINI_API_KEY)
-
 class GeminiFlash(dspy.LM):
     """DSPy module for Gemini Flash 2.5"""
     def __init__(self, model="gemini-2.5-flash", thinking_budget=0, **kwargs):
         super().__init__(model=model, **kwargs)
         self.thinking_budget = thinking_budget
 
-# Initialize model using proper DSPy Gemini integration with thinking budget
-lm = GeminiFlash(
-    model=Config.DSPY_MODEL, 
-    thinking_budget=10000,  # Enable thinking mode with 10k tokens for reasoning
-    max_tokens=12000,       # Increased output tokens
-    temperature=0.1         # Slightly increase temperature to avoid repetition
-)
-dspy.settings.configure(lm=lm)
+@lru_cache(maxsize=None)
+def build_lm(model: str, thinking_budget: int = 0, **kwargs) -> GeminiFlash:
+    """Build a GeminiFlash LM once per distinct configuration and reuse it"""
+    # Configure Google API on first LM construction
+    genai.configure(api_key=Config.GEMINI_API_KEY)
+    return GeminiFlash(model=model, thinking_budget=thinking_budget, **kwargs)
+
+def get_lm() -> GeminiFlash:
+    """Shared LM for query analysis and SQL generation"""
+    # Initialize model using proper DSPy Gemini integration with thinking budget
+    return build_lm(
+        model=Config.DSPY_MODEL, 
+        thinking_budget=10000,  # Enable thinking mode with 10k tokens for reasoning
+        max_tokens=12000,       # Increased output tokens
+        temperature=0.1         # Slightly increase temperature to avoid repetition
+    )
+
+def get_fast_lm() -> GeminiFlash:
+    """Shared LM for short classification calls (no thinking phase)"""
+    return build_lm(
+        model=Config.TIER_3_MODEL,
+        thinking_budget=0,      # Safety verdicts don't need reasoning tokens
+        max_tokens=512,
+        temperature=0.0
+    )
 
 class QueryAnalysisAndRephrasing(dspy.Signature):
     """
@@ -41,6 +56,19 @@ class QueryAnalysisAndRephrasing(dspy.Signature):
     complexity_level = dspy.OutputField(desc="Query complexity: simple, moderate, or complex")
     suggested_optimizations = dspy.OutputField(desc="ClickHouse-specific optimization hints for the query")
 
+class SQLGenerationInitial(dspy.Signature):
+    """Generate SQL from query and context.
+    
+    Think step by step:
+    1. Analyze the required data
+    2. Identify all necessary tables and their relationships
+    3. Plan the JOINs needed to connect tables
+    4. Generate the complete SQL with proper JOINs
+    """
+    rephrased_query = dspy.InputField(desc="Rephrased SQL problem statement")
+    context = dspy.InputField(desc="Relevant database schema context with table relationships")
+    sql_query = dspy.OutputField(desc="Complete SQL query with proper JOINs. If readable names are needed instead of IDs, find the appropriate lookup tables and JOIN them.")
+
 class SQLGeneration(dspy.Signature):
     """Generate SQL from query and context, optionally incorporating user feedback.
     
@@ -64,13 +92,19 @@ class SQLSafetyCheck(dspy.Signature):
     is_safe = dspy.OutputField(desc="Boolean indicating if query is safe")
     reason = dspy.OutputField(desc="Explanation if unsafe")
 
+@lru_cache(maxsize=None)
+def _shared_predictor(predictor_cls, signature):
+    """Build each predictor once per process and share it across module instances"""
+    return predictor_cls(signature)
+
 class QueryRephrasingModule(dspy.Module):
-    def __init__(self):
-        super().__init__()
-        self.analyze_and_rephrase = dspy.ChainOfThought(QueryAnalysisAndRephrasing)  # Use ChainOfThought for better analysis
+    @cached_property
+    def analyze_and_rephrase(self):
+        return _shared_predictor(dspy.ChainOfThought, QueryAnalysisAndRephrasing)  # Use ChainOfThought for better analysis
     
     def forward(self, user_query, context=""):
-        result = self.analyze_and_rephrase(user_query=user_query, context=context)
+        with dspy.context(lm=get_lm()):
+            result = self.analyze_and_rephrase(user_query=user_query, context=context)
         
         # Return structured analysis along with rephrased query
         return {
@@ -85,17 +119,26 @@ class QueryRephrasingModule(dspy.Module):
         }
 
 class SQLGenerationModule(dspy.Module):
-    def __init__(self):
-        super().__init__()
-        self.generate = dspy.ChainOfThought(SQLGeneration)  # Use ChainOfThought for better reasoning
+    @cached_property
+    def generate(self):
+        return _shared_predictor(dspy.ChainOfThought, SQLGeneration)  # Use ChainOfThought for better reasoning
+    
+    @cached_property
+    def generate_initial(self):
+        return _shared_predictor(dspy.ChainOfThought, SQLGenerationInitial)
     
     def forward(self, rephrased_query, context, user_feedback="", previous_queries=""):
-        return self.generate(rephrased_query=rephrased_query, context=context, user_feedback=user_feedback, previous_queries=previous_queries)
+        with dspy.context(lm=get_lm()):
+            # First-shot queries skip the empty feedback fields to keep the prompt small
+            if not (user_feedback or previous_queries):
+                return self.generate_initial(rephrased_query=rephrased_query, context=context)
+            return self.generate(rephrased_query=rephrased_query, context=context, user_feedback=user_feedback, previous_queries=previous_queries)
 
 class SQLSafetyCheckModule(dspy.Module):
-    def __init__(self):
-        super().__init__()
-        self.check = dspy.Predict(SQLSafetyCheck)
+    @cached_property
+    def check(self):
+        return _shared_predictor(dspy.Predict, SQLSafetyCheck)
     
     def forward(self, sql_query):
-        return self.check(sql_query=sql_query)
\ No newline at end of file
+        with dspy.context(lm=get_fast_lm()):
+            return self.check(sql_query=sql_query)
\ No newline at end of file
@@ -1,7 +1,12 @@
 import clickhouse_connect
+from clickhouse_connect.driver import httputil
+from clickhouse_connect.driver.binding import quote_identifier
 import os
-import pandas as pd
+import csv
 import logging
+import threading
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from dotenv import load_dotenv
 load_dotenv()
@@ -19,15 +24,25 @@ if __name__ == "__main__":
 
 logger = logging.getLogger(__name__)
 
-# Establish connection to clickhouse
-logger.info("🔌 Establishing connection to ClickHouse...")
-try:
-    client = clickhouse_connect.get_client(
+# Shared HTTP connection pool for all clients; the default caps out once tables run in parallel
+POOL_SIZE = 32
+pool_mgr = httputil.get_pool_manager(maxsize=POOL_SIZE, num_pools=POOL_SIZE)
+
+def create_client():
+    """Create a ClickHouse client from environment settings"""
+    return clickhouse_connect.get_client(
         host=os.getenv("ch_host"),   
         username=os.getenv("ch_username"),           
         password=os.getenv("ch_password"),
-        secure=True
+        secure=True,
+        autogenerate_session_id=False,  # No session state, so clients can run queries concurrently
+        pool_mgr=pool_mgr
     )
+
+# Establish connection to clickhouse
+logger.info("🔌 Establishing connection to ClickHouse...")
+try:
+    client = create_client()
     logger.info("✅ Successfully connected to ClickHouse")
 except Exception as e:
     logger.error(f"❌ Failed to connect to ClickHouse: {e}")
@@ -36,6 +51,47 @@ except Exception as e:
 database = os.getenv("ch_database")
 logger.info(f"🗄️  Target database: {database}")
 
+# Column order of the metadata CSV
+CSV_FIELDS = [
+    'table_name', 'column_name', 'data_type', 'cardinality', 'cardinality_level',
+    'total_rows', 'primary_key', 'distinct_values', 'neighbouring_columns'
+]
+
+def table_ref(database, table):
+    """Fully qualified, safely quoted table identifier"""
+    return f"{quote_identifier(database)}.{quote_identifier(table)}"
+
+def stats_settings(client):
+    """Query settings for the statistics scans: use the server query cache where available (23.1+)"""
+    return {'use_query_cache': 1} if client.min_version('23.1') else {}
+
+# Columns with fewer distinct values than this are 'Low' cardinality
+LOW_CARDINALITY_THRESHOLD = 30
+
+# Up to this many distinct values are fetched per column: any column that
+# returns fewer has an exact cardinality, so only larger ones need uniq()
+SAMPLE_PROBE_SIZE = LOW_CARDINALITY_THRESHOLD + 1
+
+def summarize_samples(samples, estimate=None):
+    """
+    Derive cardinality and the stored sample values from a distinct-value probe
+    
+    Args:
+        samples: Up to SAMPLE_PROBE_SIZE distinct values
+        estimate: Approximate distinct count, used only when the probe is full
+    
+    Returns:
+        tuple: (cardinality, sample_values)
+    """
+    if len(samples) < SAMPLE_PROBE_SIZE:
+        cardinality = len(samples)  # Exact: the probe saw every distinct value
+    else:
+        cardinality = max(estimate or 0, len(samples))
+    
+    # Low cardinality columns keep 3 examples, others 30
+    samples = samples[:3] if cardinality < LOW_CARDINALITY_THRESHOLD else samples[:30]
+    return cardinality, [str(value) for value in samples]
+
 def classify_cardinality(cardinality, total_rows=None):
     """
     Classify column cardinality as High or Low
@@ -50,9 +106,208 @@ def classify_cardinality(cardinality, total_rows=None):
     if isinstance(cardinality, str):  # Handle error cases
         return 'Unknown'
     
-    return 'Low' if cardinality < 30 else 'High'
+    return 'Low' if cardinality < LOW_CARDINALITY_THRESHOLD else 'High'
+
+def get_table_column_stats(client, database, table, column_names, primary_key_columns=()):
+    """
+    Compute cardinality and sample values for all columns of a table in a single scan
+    
+    Args:
+        client: ClickHouse client
+        database: Database name
+        table: Table name
+        column_names: Column names, in order
+        primary_key_columns: Primary key columns; their high cardinality is taken
+            as the row count instead of being estimated with uniq()
+    
+    Returns:
+        tuple: (list of (cardinality, sample_values) per column, total row count)
+    """
+    select_parts = []
+    for idx, col_name in enumerate(column_names):
+        column = quote_identifier(col_name)
+        if col_name not in primary_key_columns:
+            select_parts.append(f"uniq({column}) AS u_{idx}")
+        select_parts.append(f"groupUniqArray({SAMPLE_PROBE_SIZE})({column}) AS s_{idx}")
+    select_parts.append("count() AS total_rows")
+    
+    # The query text is stable per table, so reruns can be served from the query cache
+    stats_query = f"SELECT {', '.join(select_parts)} FROM {table_ref(database, table)}"
+    row = client.query(stats_query, settings=stats_settings(client)).first_item
+    
+    total_rows = row['total_rows']
+    stats = [
+        summarize_samples(row[f's_{idx}'], row.get(f'u_{idx}', total_rows))
+        for idx in range(len(column_names))
+    ]
+    return stats, total_rows
+
+def is_low_cardinality_type(col_type):
+    """Whether a ClickHouse type is dictionary encoded (LowCardinality(...))"""
+    return col_type.startswith('LowCardinality(')
+
+def get_column_stats(client, database, table, col_name, is_pk=False, total_rows=None, low_cardinality=False):
+    """
+    Compute cardinality and sample values for a single column (fallback path)
+    
+    Primary key columns with a full probe take the row count as their
+    cardinality rather than running a uniq() scan. LowCardinality columns
+    are grouped on their dictionary keys, which also makes an exact count cheap.
+    
+    Returns:
+        tuple: (cardinality, sample_values)
+    """
+    column = quote_identifier(col_name)
+    source = table_ref(database, table)
+    settings = stats_settings(client)
+    if low_cardinality:
+        # GROUP BY runs on the dictionary keys and is faster than DISTINCT for LowCardinality
+        distinct_query = f"SELECT {column} FROM {source} GROUP BY {column} LIMIT {SAMPLE_PROBE_SIZE}"
+    else:
+        # DISTINCT with a LIMIT stops scanning once enough values are found
+        distinct_query = f"SELECT DISTINCT {column} FROM {source} LIMIT {SAMPLE_PROBE_SIZE}"
+    result = client.query(distinct_query, settings=settings)
+    # Read the single column directly rather than unpacking per-row tuples
+    samples = list(result.result_columns[0]) if result.row_count else []
+    
+    estimate = None
+    if len(samples) >= SAMPLE_PROBE_SIZE and is_pk and total_rows is not None:
+        estimate = total_rows
+    elif len(samples) >= SAMPLE_PROBE_SIZE and low_cardinality:
+        group_count_query = f"SELECT count() FROM (SELECT {column} FROM {source} GROUP BY {column})"
+        estimate = client.command(group_count_query, settings=settings)
+    elif len(samples) >= SAMPLE_PROBE_SIZE:
+        cardinality_query = f"SELECT uniq({column}) FROM {source}"
+        estimate = client.command(cardinality_query, settings=settings)
+    
+    return summarize_samples(samples, estimate)
+
+def process_table(client, database, table, table_idx, total_tables, known_rows=None, columns=None):
+    """
+    Extract column metadata for a single table
+    
+    Args:
+        known_rows: Row count from system.tables, if the engine tracks it
+        columns: (name, type, is_in_primary_key) tuples, fetched here if not given
+    
+    Returns:
+        list: Metadata records, one per column
+    """
+    table_progress = f"({table_idx}/{total_tables})"
+    logger.info(f"🔍 Step 2/4: Processing table {table_progress}: {table}")
+    
+    rows = []
+    
+    # Get column information including data types and primary key status
+    if columns is None:
+        logger.debug(f"   🏗️  Fetching column metadata for {table}")
+        column_query = """
+        SELECT name, type, is_in_primary_key 
+        FROM system.columns 
+        WHERE database = {database:String} AND table = {table:String}
+        ORDER BY position
+        """
+        try:
+            columns = client.query(column_query, parameters={'database': database, 'table': table}).result_rows
+        except Exception as e:
+            logger.error(f"   ❌ Failed to get columns for {table}: {e}")
+            return []
+    logger.debug(f"   ✅ Found {len(columns)} columns in {table}")
+    
+    # Get all column names for neighbouring_columns
+    all_column_names = [col[0] for col in columns]
+    
+    # Neighbouring columns (all columns except the current one), built once per table
+    neighbour_strs = {
+        name: ', '.join(other for other in all_column_names if other != name)
+        for name in all_column_names
+    }
+    
+    # Compute cardinality, samples and row count for all columns in one scan
+    column_stats = None
+    try:
+        logger.debug(f"   📈 Calculating column statistics for {table}")
+        primary_key_columns = {col[0] for col in columns if col[2]}
+        column_stats, total_rows = get_table_column_stats(
+            client, database, table, all_column_names, primary_key_columns
+        )
+        logger.debug(f"   ✅ Table {table} has {total_rows:,} rows")
+    except Exception as e:
+        logger.warning(f"   ⚠️  Batched statistics failed for {table}, falling back to per-column queries: {e}")
+        
+        # Get total row count for the table, unless system.tables already had it
+        total_rows = known_rows
+        if total_rows is None:
+            try:
+                logger.debug(f"   📊 Getting row count for {table}")
+                row_count_query = f"SELECT count(*) FROM {table_ref(database, table)}"
+                total_rows = client.command(row_count_query, settings=stats_settings(client))
+                logger.debug(f"   ✅ Table {table} has {total_rows:,} rows")
+            except Exception as e:
+                logger.warning(f"   ⚠️  Error getting row count for {table}: {e}")
+                total_rows = None
+    
+    # Per-column debug messages use lazy %-formatting; nothing is formatted at INFO level
+    debug_enabled = logger.isEnabledFor(logging.DEBUG)
+    for col_idx, (col_name, col_type, is_pk) in enumerate(columns, 1):
+        logger.debug("     🔧 Step 3/4: Processing column (%d/%d): %s.%s", col_idx, len(columns), table, col_name)
+        
+        try:
+            if column_stats is not None:
+                cardinality, distinct_values = column_stats[col_idx - 1]
+            else:
+                # Calculate cardinality (distinct count) and sample values
+                logger.debug("       📈 Calculating cardinality for %s", col_name)
+                cardinality, distinct_values = get_column_stats(
+                    client, database, table, col_name, is_pk=is_pk, total_rows=total_rows,
+                    low_cardinality=is_low_cardinality_type(col_type)
+                )
+            
+            # Classify cardinality level
+            cardinality_level = classify_cardinality(cardinality, total_rows)
+            
+            # Create metadata record
+            rows.append({
+                'table_name': table,
+                'column_name': col_name,
+                'data_type': col_type,
+                'cardinality': cardinality,
+                'cardinality_level': cardinality_level,
+                'total_rows': total_rows,
+                'primary_key': 'Yes' if is_pk else 'No',
+                'distinct_values': ', '.join(distinct_values) if distinct_values else '',
+                'neighbouring_columns': neighbour_strs[col_name]
+            })
+            
+            if debug_enabled:
+                logger.debug(f"       ✅ Successfully processed {col_name} - {cardinality_level} cardinality ({cardinality:,} distinct)")
+        
+        except Exception as e:
+            logger.error(f"       ❌ Error processing {table}.{col_name}: {e}")
+            
+            # Add record with error info
+            rows.append({
+                'table_name': table,
+                'column_name': col_name,
+                'data_type': col_type,
+                'cardinality': 'Error',
+                'cardinality_level': 'Unknown',
+                'total_rows': total_rows,
+                'primary_key': 'Yes' if is_pk else 'No',
+                'distinct_values': f'Error: {str(e)}',
+                'neighbouring_columns': neighbour_strs[col_name]
+            })
+    
+    return rows
 
-def get_comprehensive_database_metadata(client, database, output_file=None, test_mode=None):
+def get_comprehensive_database_metadata(client, database, output_file=None, test_mode=None, max_workers=8,
+                                        client_factory=None):
+    """Extract column metadata for every table in `database` into a CSV, returning the rows written
+    
+    Worker threads share `client` (which must not use a session, like create_client's
+    clients), unless `client_factory` is given: then each thread calls it once for its
+    own client, which should point at the same server as `client`.
+    """
     if output_file is None:
         # Get the directory containing this script, then go up one level to project root
         script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -64,124 +319,80 @@ def get_comprehensive_database_metadata(client, database, output_file=None, test
     
     # Step 1: Get all table names in the database
     logger.info("📋 Step 1/4: Fetching table names from database")
-    table_query = f"SELECT name FROM system.tables WHERE database = '{database}'"
+    # total_rows is tracked by MergeTree-family engines (NULL for views etc.)
+    table_query = "SELECT name, total_rows FROM system.tables WHERE database = {database:String}"
     try:
-        table_names = [row[0] for row in client.query(table_query).result_rows]
+        rows_by_table = dict(client.query(table_query, parameters={'database': database}).result_rows)
+        table_names = list(rows_by_table)
         logger.info(f"✅ Found {len(table_names)} tables: {', '.join(table_names)}")
     except Exception as e:
         logger.error(f"❌ Failed to fetch table names: {e}")
         raise
     
-    metadata = []
+    # Column definitions for every table in one round trip, grouped by table
+    columns_query = """
+    SELECT table, name, type, is_in_primary_key 
+    FROM system.columns 
+    WHERE database = {database:String}
+    ORDER BY table, position
+    """
+    try:
+        columns_by_table = defaultdict(list)
+        for table, *column in client.query(columns_query, parameters={'database': database}).result_rows:
+            columns_by_table[table].append(tuple(column))
+    except Exception as e:
+        logger.warning(f"⚠️  Bulk column lookup failed, fetching columns per table: {e}")
+        columns_by_table = None
+    
     total_tables = len(table_names)
     processed_columns = 0
+    records_written = 0
+    cardinality_counts = Counter()
     
-    for table_idx, table in enumerate(table_names, 1):
-        table_progress = f"({table_idx}/{total_tables})"
-        logger.info(f"🔍 Step 2/4: Processing table {table_progress}: {table}")
-        
-        # Get total row count for the table
-        try:
-            logger.debug(f"   📊 Getting row count for {table}")
-            row_count_query = f"SELECT count(*) FROM `{database}`.`{table}`"
-            total_rows = client.query(row_count_query).result_rows[0][0]
-            logger.debug(f"   ✅ Table {table} has {total_rows:,} rows")
-        except Exception as e:
-            logger.warning(f"   ⚠️  Error getting row count for {table}: {e}")
-            total_rows = None
-        
-        # Get column information including data types and primary key status
-        logger.debug(f"   🏗️  Fetching column metadata for {table}")
-        column_query = f"""
-        SELECT name, type, is_in_primary_key 
-        FROM system.columns 
-        WHERE database = '{database}' AND table = '{table}'
-        """
-        try:
-            columns = client.query(column_query).result_rows
-            logger.debug(f"   ✅ Found {len(columns)} columns in {table}")
-            
-            # Get all column names for neighbouring_columns
-            all_column_names = [col[0] for col in columns]
-        except Exception as e:
-            logger.error(f"   ❌ Failed to get columns for {table}: {e}")
-            continue
-        
-        for col_idx, (col_name, col_type, is_pk) in enumerate(columns, 1):
-            processed_columns += 1
-            col_progress = f"({col_idx}/{len(columns)})"
-            logger.debug(f"     🔧 Step 3/4: Processing column {col_progress}: {table}.{col_name}")
+    # Process tables concurrently, on the caller's client or one factory client per worker thread
+    thread_state = threading.local()
+    
+    def extract_table(args):
+        table_idx, table = args
+        if client_factory is None:
+            worker_client = client
+        else:
+            if not hasattr(thread_state, 'client'):
+                thread_state.client = client_factory()
+            worker_client = thread_state.client
+        columns = columns_by_table[table] if columns_by_table is not None else None
+        return process_table(
+            worker_client, database, table, table_idx, total_tables,
+            known_rows=rows_by_table[table], columns=columns
+        )
+    
+    # Step 4: Rows are appended to the CSV as each table completes
+    logger.info(f"💾 Step 4/4: Streaming metadata to {output_file}")
+    if test_mode:
+        logger.info(f"🧪 Test mode: Saving only first {test_mode} rows to CSV")
+    
+    try:
+        with open(output_file, 'w', newline='', encoding='utf-8') as f, \
+                ThreadPoolExecutor(max_workers=max_workers) as executor:
+            writer = csv.DictWriter(f, fieldnames=CSV_FIELDS)
+            writer.writeheader()
             
-            try:
-                # Calculate cardinality (distinct count)
-                logger.debug(f"       📈 Calculating cardinality for {col_name}")
-                cardinality_query = f"SELECT count(DISTINCT `{col_name}`) FROM `{database}`.`{table}`"
-                cardinality = client.query(cardinality_query).result_rows[0][0]
-                
-                # Get distinct values based on cardinality
-                logger.debug(f"       🎯 Fetching sample values for {col_name} (cardinality: {cardinality})")
-                if cardinality < 30:
-                    distinct_query = f"SELECT DISTINCT `{col_name}` FROM `{database}`.`{table}` LIMIT 3"
-                else:
-                    distinct_query = f"SELECT DISTINCT `{col_name}` FROM `{database}`.`{table}` LIMIT 30"
-                
-                distinct_results = client.query(distinct_query).result_rows
-                distinct_values = [str(row[0]) for row in distinct_results]
-                
-                # Classify cardinality level
-                cardinality_level = classify_cardinality(cardinality, total_rows)
+            # map() yields in table order, so the CSV layout matches the serial version
+            table_results = executor.map(extract_table, enumerate(table_names, 1))
+            for table_idx, (table, table_rows) in enumerate(zip(table_names, table_results), 1):
+                processed_columns += len(table_rows)
                 
-                # Get neighbouring columns (all columns except current one)
-                neighbouring_columns = [col for col in all_column_names if col != col_name]
+                # Apply test mode if specified (limit to first N rows)
+                if test_mode:
+                    table_rows = table_rows[:max(test_mode - records_written, 0)]
                 
-                # Create metadata record
-                metadata.append({
-                    'table_name': table,
-                    'column_name': col_name,
-                    'data_type': col_type,
-                    'cardinality': cardinality,
-                    'cardinality_level': cardinality_level,
-                    'total_rows': total_rows,
-                    'primary_key': 'Yes' if is_pk else 'No',
-                    'distinct_values': ', '.join(distinct_values) if distinct_values else '',
-                    'neighbouring_columns': ', '.join(neighbouring_columns)
-                })
+                writer.writerows(table_rows)
+                records_written += len(table_rows)
+                cardinality_counts.update(row['cardinality_level'] for row in table_rows)
                 
-                logger.debug(f"       ✅ Successfully processed {col_name} - {cardinality_level} cardinality ({cardinality:,} distinct)")
-                
-            except Exception as e:
-                logger.error(f"       ❌ Error processing {table}.{col_name}: {e}")
-                # Get neighbouring columns (all columns except current one)
-                neighbouring_columns = [col for col in all_column_names if col != col_name]
-                
-                # Add record with error info
-                metadata.append({
-                    'table_name': table,
-                    'column_name': col_name,
-                    'data_type': col_type,
-                    'cardinality': 'Error',
-                    'cardinality_level': 'Unknown',
-                    'total_rows': total_rows,
-                    'primary_key': 'Yes' if is_pk else 'No',
-                    'distinct_values': f'Error: {str(e)}',
-                    'neighbouring_columns': ', '.join(neighbouring_columns)
-                })
-        
-        # Progress update after each table
-        progress_pct = (table_idx / total_tables) * 100
-        logger.info(f"   ✅ Completed table {table} - Progress: {progress_pct:.1f}% ({table_idx}/{total_tables} tables)")
-    
-    # Step 4: Create DataFrame and save to CSV
-    logger.info("💾 Step 4/4: Saving metadata to CSV file")
-    try:
-        df = pd.DataFrame(metadata)
-        
-        # Apply test mode if specified (limit to first N rows)
-        if test_mode:
-            df = df.head(test_mode)
-            logger.info(f"🧪 Test mode: Saving only first {test_mode} rows to CSV")
-        
-        df.to_csv(output_file, index=False)
+                # Progress update after each table
+                progress_pct = (table_idx / total_tables) * 100
+                logger.info(f"   ✅ Completed table {table} - Progress: {progress_pct:.1f}% ({table_idx}/{total_tables} tables)")
         
         # Summary statistics
         end_time = datetime.now()
@@ -191,19 +402,18 @@ def get_comprehensive_database_metadata(client, database, output_file=None, test
         logger.info(f"📊 Summary:")
         logger.info(f"   • Tables processed: {total_tables}")
         logger.info(f"   • Columns processed: {processed_columns}")
-        logger.info(f"   • Total records: {len(metadata)}")
+        logger.info(f"   • Total records: {records_written}")
         logger.info(f"   • Duration: {duration}")
         logger.info(f"   • Output file: {output_file}")
         
         # Cardinality breakdown
-        if len(metadata) > 0:
-            cardinality_counts = df['cardinality_level'].value_counts()
+        if records_written > 0:
             logger.info(f"📈 Cardinality breakdown:")
-            for level, count in cardinality_counts.items():
-                pct = (count / len(metadata)) * 100
+            for level, count in cardinality_counts.most_common():
+                pct = (count / records_written) * 100
                 logger.info(f"   • {level}: {count} columns ({pct:.1f}%)")
         
-        return df
+        return records_written
         
     except Exception as e:
         logger.error(f"❌ Failed to save metadata: {e}")
@@ -218,7 +428,7 @@ if __name__ == "__main__":
     logger.info("=" * 60)
     
     try:
-        df_metadata = get_comprehensive_database_metadata(client, database)
+        get_comprehensive_database_metadata(client, database, client_factory=create_client)
         logger.info("=" * 60)
         logger.info("✅ METADATA EXTRACTION COMPLETED SUCCESSFULLY")
         logger.info("=" * 60)
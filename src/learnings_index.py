@@ -0,0 +1,255 @@
+# src/learnings_index.py
+import json
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+import numpy as np
+import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+from src.config import Config
+
+try:
+    import faiss  # Optional: SIMD exact scan, and HNSW once the learnings outgrow it
+except ImportError:
+    faiss = None
+
+# Same embedding model the MindsDB knowledge bases are created with
+EMBEDDING_MODEL = "models/text-embedding-004"
+EMBEDDING_DIM = 768
+EMBED_BATCH_SIZE = 100  # Maximum texts per batch embedding request
+EMBED_CONCURRENCY = 4  # Batch requests in flight at once
+EMBED_RETRIES = 4
+# Rate limits and transient server errors; anything else (bad key, bad request) fails at once
+RETRYABLE_ERRORS = (
+    google_exceptions.TooManyRequests,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.InternalServerError,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+)
+
+# Below this many learnings a brute-force scan is faster than building a graph
+EXACT_SEARCH_LIMIT = 1000
+HNSW_CONNECTIVITY = 16
+HNSW_EF_CONSTRUCTION = 64
+HNSW_EF_SEARCH = 100
+RESCORE_FACTOR = 4  # int8 graph candidates per result, rescored in float16
+
+QUERY_CACHE_SIZE = 1024  # Recent query embeddings kept to skip the embedding round trip
+
+# Written by update_learnings_kb.py so other processes skip re-embedding on start
+INDEX_DIR = "outputs/.learnings_index"
+
+SUCCESSFUL_QUERIES_FILE = "data/successful_queries.md"
+_INSIGHT_PREFIXES = ("**Learning:**", "**Key Insight:**")
+
+def parse_learnings_file(path: str = SUCCESSFUL_QUERIES_FILE) -> List[Tuple[str, str]]:
+    """Stream the learnings file into (title, insight) tuples, one per example with an insight"""
+    blocks = []
+    query_title = None  # Title of the current example until its insight is found
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.startswith("### "):
+                query_title = line[4:].strip()
+                continue
+
+            if query_title is None:
+                continue
+
+            # Take the first Learning or Key Insight line, then skip the rest of the block
+            for prefix in _INSIGHT_PREFIXES:
+                if line.startswith(prefix):
+                    blocks.append((query_title, line[len(prefix):].strip()))
+                    query_title = None
+                    break
+    return blocks
+
+def _embed_batch(texts: List[str]) -> list:
+    """One batch embedding request; rate-limit and server errors are retried with jittered backoff"""
+    for attempt in range(EMBED_RETRIES):
+        try:
+            return genai.embed_content(model=EMBEDDING_MODEL, content=texts)['embedding']
+        except RETRYABLE_ERRORS:
+            if attempt == EMBED_RETRIES - 1:
+                raise
+            time.sleep(2 ** attempt + random.random())
+
+def embed_texts(texts: List[str]) -> np.ndarray:
+    """Embed texts as L2-normalised float32 rows, so inner product is cosine similarity"""
+    genai.configure(api_key=Config.GEMINI_API_KEY)
+    vectors = np.empty((len(texts), EMBEDDING_DIM), dtype='float32')
+    starts = range(0, len(texts), EMBED_BATCH_SIZE)
+    if len(starts) == 1:
+        vectors[:] = _embed_batch(texts)
+    elif starts:
+        # Requests are I/O-bound, so a few threads overlap their round trips
+        with ThreadPoolExecutor(max_workers=min(len(starts), EMBED_CONCURRENCY)) as executor:
+            batches = executor.map(lambda start: _embed_batch(texts[start:start + EMBED_BATCH_SIZE]), starts)
+            for start, batch in zip(starts, batches):
+                vectors[start:start + len(batch)] = batch
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    return vectors
+
+class LearningsIndex:
+    """Semantic index over (title, insight) learnings blocks
+
+    Small collections are scanned exactly (with faiss's kernels when installed,
+    numpy otherwise). Past EXACT_SEARCH_LIMIT vectors, and with faiss
+    installed, searches go through an HNSW graph over int8 scalar-quantized
+    vectors, whose top RESCORE_FACTOR * top_k candidates are rescored against
+    half-precision copies.
+    The blocks list is shared with its owner, which appends new learnings;
+    titles not yet embedded are added (in one batch) on the next search.
+    Embeddings saved under INDEX_DIR are memory-mapped back as long as
+    their titles still match the leading blocks.
+    """
+
+    def __init__(self, blocks: List[Tuple[str, str]], path: str = INDEX_DIR):
+        self.blocks = blocks
+        self.path = path
+        # Row i embeds blocks[i]; capacity grows geometrically so appends rarely copy
+        self._matrix = np.empty((0, EMBEDDING_DIM), dtype='float32')
+        self._count = 0
+        self.hnsw = None
+        self._graph = None
+        self._query_cache = OrderedDict()  # Query text -> normalised embedding, in LRU order
+        self._lock = threading.Lock()
+        self._load()
+
+    @classmethod
+    def create(cls, path: str = SUCCESSFUL_QUERIES_FILE) -> 'LearningsIndex':
+        """Index over the learnings currently in the file at `path` (empty if it doesn't exist)"""
+        return cls(parse_learnings_file(path) if os.path.exists(path) else [])
+
+    def _load(self) -> None:
+        """Reuse persisted embeddings (and graph) if they were built from the same titles"""
+        try:
+            with open(os.path.join(self.path, 'titles.json'), 'r', encoding='utf-8') as f:
+                titles = json.load(f)
+            vectors = np.load(os.path.join(self.path, 'vectors.npy'), mmap_mode='r')
+        except (OSError, ValueError):
+            return
+        if len(titles) != len(vectors) or titles != [title for title, _ in self.blocks[:len(titles)]]:
+            return
+
+        # Read-only map: the first append copies it into a growable buffer
+        self._matrix = vectors
+        self._count = len(vectors)
+
+        graph_path = os.path.join(self.path, 'hnsw.faiss')
+        if faiss is not None and os.path.exists(graph_path):
+            try:
+                hnsw = faiss.read_index(graph_path)
+            except RuntimeError:
+                return
+            if hnsw.ntotal == self._count:
+                self.hnsw = hnsw
+
+    def save(self) -> None:
+        """Embed any pending blocks and write the index to disk for later processes"""
+        with self._lock:
+            self._sync()
+            os.makedirs(self.path, exist_ok=True)
+            suffix = f".{os.getpid()}.tmp"
+
+            path = os.path.join(self.path, 'vectors.npy')
+            with open(path + suffix, 'wb') as f:
+                np.save(f, self.vectors)
+            os.replace(path + suffix, path)
+
+            path = os.path.join(self.path, 'hnsw.faiss')
+            if self.hnsw is not None:
+                faiss.write_index(self.hnsw, path + suffix)
+                os.replace(path + suffix, path)
+            elif os.path.exists(path):
+                os.remove(path)
+
+            # Titles last: readers ignore the vectors unless both agree in length
+            path = os.path.join(self.path, 'titles.json')
+            with open(path + suffix, 'w', encoding='utf-8') as f:
+                json.dump([title for title, _ in self.blocks[:self._count]], f)
+            os.replace(path + suffix, path)
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """Contiguous (N, EMBEDDING_DIM) view of the embedded rows"""
+        return self._matrix[:self._count]
+
+    def _sync(self) -> None:
+        """Embed blocks appended since the last search (caller holds the lock)"""
+        pending = self.blocks[self._count:]
+        if not pending:
+            return
+        added = embed_texts([title for title, _ in pending])
+        count = self._count + len(added)
+        if count > len(self._matrix):
+            grown = np.empty((max(count, 2 * len(self._matrix)), EMBEDDING_DIM), dtype='float32')
+            grown[:self._count] = self.vectors
+            self._matrix = grown
+        self._matrix[self._count:count] = added
+        self._count = count
+
+        if self.hnsw is not None:
+            self.hnsw.add(added)
+        elif faiss is not None and count >= EXACT_SEARCH_LIMIT:
+            graph = faiss.IndexHNSWSQ(EMBEDDING_DIM, faiss.ScalarQuantizer.QT_8bit,
+                                      HNSW_CONNECTIVITY, faiss.METRIC_INNER_PRODUCT)
+            graph.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+            graph.hnsw.efSearch = HNSW_EF_SEARCH
+            rescorer = faiss.IndexScalarQuantizer(EMBEDDING_DIM, faiss.ScalarQuantizer.QT_fp16,
+                                                  faiss.METRIC_INNER_PRODUCT)
+            self.hnsw = faiss.IndexRefine(graph, rescorer)
+            self.hnsw.k_factor = RESCORE_FACTOR
+            self._graph = (graph, rescorer)  # The refine wrapper does not own its sub-indexes
+            # Quantizer ranges come from the vectors seen so far; rescoring absorbs later drift
+            self.hnsw.train(self.vectors)
+            self.hnsw.add(self.vectors)
+
+    def _embed_queries(self, queries: List[str]) -> np.ndarray:
+        """Embed queries, requesting only those not embedded recently (caller holds the lock)"""
+        cache = self._query_cache
+        missing = [query for query in dict.fromkeys(queries) if query not in cache]
+        if missing:
+            cache.update(zip(missing, embed_texts(missing)))
+        for query in queries:
+            cache.move_to_end(query)
+        vectors = np.stack([cache[query] for query in queries])
+        while len(cache) > QUERY_CACHE_SIZE:
+            cache.popitem(last=False)
+        return vectors
+
+    def search(self, query: str, top_k: int = 3, exact: bool = False) -> List[Tuple[str, str]]:
+        """Return up to top_k blocks whose titles are most similar to the query
+
+        exact=True always scans every vector, bypassing the HNSW graph.
+        """
+        return self.search_batch([query], top_k, exact)[0]
+
+    def search_batch(self, queries: List[str], top_k: int = 3, exact: bool = False) -> List[List[Tuple[str, str]]]:
+        """Search several queries at once: one embedding request and one matrix product for all"""
+        if not queries:
+            return []
+        with self._lock:
+            self._sync()
+            count = self._count
+            if not count:
+                return [[] for _ in queries]
+            query_vectors = self._embed_queries(queries)
+            top_k = min(top_k, count)
+
+            if self.hnsw is not None and not exact:
+                _, ids = self.hnsw.search(query_vectors, top_k)
+            elif faiss is not None:
+                # Fused SIMD inner-product scan and heap selection, straight over the matrix
+                _, ids = faiss.knn(query_vectors, self.vectors, top_k, metric=faiss.METRIC_INNER_PRODUCT)
+            else:
+                scores = query_vectors @ self.vectors.T  # (queries, N) in a single GEMM
+                # O(N) selection of each row's top_k, then only those are sorted
+                ids = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+                order = np.argsort(-np.take_along_axis(scores, ids, axis=1), axis=1)
+                ids = np.take_along_axis(ids, order, axis=1)
+        return [[self.blocks[i] for i in row if i >= 0] for row in ids]
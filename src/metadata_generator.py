@@ -1,11 +1,14 @@
 import os
+import json
+import time
+import hashlib
+import threading
 import pandas as pd
 import dspy
 from typing import List, Dict
 from dotenv import load_dotenv
 import logging
 from concurrent.futures import ThreadPoolExecutor, as_completed
-import time
 
 # Load environment variables
 load_dotenv()
@@ -45,6 +48,82 @@ except Exception as e:
 # Configure DSPy
 dspy.settings.configure(lm=column_model)
 
+class RateLimiter:
+    """Thread-safe token bucket: allows bursts up to `rate` calls, refilled evenly over `period` seconds"""
+    
+    def __init__(self, rate: int, period: float = 60.0):
+        self.capacity = rate
+        self.tokens = float(rate)
+        self.fill_rate = rate / period
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+    
+    def acquire(self):
+        """Block until a call is allowed; returns immediately while under quota"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.fill_rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.fill_rate
+            time.sleep(wait)
+    
+    def __enter__(self):
+        self.acquire()
+        return self
+    
+    def __exit__(self, *exc):
+        return False
+
+# Shared across all describer threads; only actual LLM calls (not cache hits) consume quota
+llm_limiter = RateLimiter(int(os.getenv("llm_rpm", "600")))
+
+# Column descriptions are cached on disk so reruns only call the LLM for changed columns
+DESCRIPTION_CACHE_DIR = "outputs/.desc_cache"
+
+# Column fields a description depends on besides its table; the in-run dedup key is
+# built from these, and the disk cache key from these plus the table name
+DESCRIPTION_INPUTS = ('column_name', 'data_type', 'cardinality_level', 'primary_key',
+                      'distinct_values', 'neighbouring_columns')
+
+def _description_cache_path(table_name: str, col: Dict) -> str:
+    """Path of the cache entry for one table's column"""
+    payload = {'table_name': table_name, **{key: col[key] for key in DESCRIPTION_INPUTS}}
+    key = hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    return os.path.join(DESCRIPTION_CACHE_DIR, f"{key}.json")
+
+def _column_signature(col: Dict) -> str:
+    """Hash of the description inputs other than the table name
+    
+    Neighbouring columns are part of the key, so only columns of tables with the
+    same schema (e.g. per-period copies) share a description; users.id and
+    orders.id do not.
+    """
+    payload = {key: col[key] for key in DESCRIPTION_INPUTS}
+    return hashlib.sha1(json.dumps(payload, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+def _read_cached_description(path: str):
+    """Return the cached description, or None if there is no usable entry"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)['description']
+    except (OSError, ValueError, KeyError):
+        return None
+
+def _write_cached_description(path: str, description: str) -> None:
+    """Store a description atomically (several worker threads write concurrently)"""
+    try:
+        os.makedirs(DESCRIPTION_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'description': description}, f)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"⚠️  Could not cache description: {e}")
+
 # DSPy Signatures
 class GenerateColumnDescription(dspy.Signature):
     """Generate concise column description without filler words. Rules:
@@ -77,47 +156,79 @@ class GenerateTableDescription(dspy.Signature):
 
 # DSPy Modules
 class ColumnDescriber(dspy.Module):
+    _generate = None  # Predictor shared by every instance in the process
+    
+    @classmethod
+    def _get_generate(cls):
+        if cls._generate is None:
+            cls._generate = dspy.Predict(GenerateColumnDescription)
+        return cls._generate
+    
     def __init__(self):
         super().__init__()
-        self.generate = dspy.Predict(GenerateColumnDescription)
+        self.generate = self._get_generate()
         
     def forward(self, table_name: str, column_name: str, data_type: str,
                 cardinality: int, cardinality_level: str, total_rows: int,
                 primary_key: str, distinct_values: int, neighboring_columns: str) -> str:
         
+        cache_path = _description_cache_path(table_name, {
+            'column_name': column_name,
+            'data_type': data_type,
+            'cardinality_level': cardinality_level,
+            'primary_key': primary_key,
+            'distinct_values': distinct_values,
+            'neighbouring_columns': neighboring_columns
+        })
+        cached = _read_cached_description(cache_path)
+        if cached is not None:
+            return cached
+        
         try:
-            result = self.generate(
-                table_name=table_name,
-                column_name=column_name,
-                data_type=data_type,
-                cardinality=cardinality,
-                cardinality_level=cardinality_level,
-                total_rows=total_rows,
-                primary_key=primary_key,
-                distinct_values=distinct_values,
-                neighboring_columns=neighboring_columns
-            )
+            with llm_limiter:
+                result = self.generate(
+                    table_name=table_name,
+                    column_name=column_name,
+                    data_type=data_type,
+                    cardinality=cardinality,
+                    cardinality_level=cardinality_level,
+                    total_rows=total_rows,
+                    primary_key=primary_key,
+                    distinct_values=distinct_values,
+                    neighboring_columns=neighboring_columns
+                )
             
             description = result.description.strip()
-            return description[:997] + "..." if len(description) > 1000 else description
+            description = description[:997] + "..." if len(description) > 1000 else description
+            _write_cached_description(cache_path, description)
+            return description
             
         except Exception as e:
             logger.error(f"❌ Error generating description for {column_name}: {e}")
             return "Description generation failed"
 
 class TableDescriber(dspy.Module):
+    _generate = None  # Predictor shared by every instance in the process
+    
+    @classmethod
+    def _get_generate(cls):
+        if cls._generate is None:
+            cls._generate = dspy.Predict(GenerateTableDescription)
+        return cls._generate
+    
     def __init__(self):
         super().__init__()
-        self.generate = dspy.Predict(GenerateTableDescription)
+        self.generate = self._get_generate()
         
     def forward(self, table_name: str, total_rows: int, columns_summary: str) -> str:
         
         try:
-            result = self.generate(
-                table_name=table_name,
-                total_rows=total_rows,
-                columns_summary=columns_summary
-            )
+            with llm_limiter:
+                result = self.generate(
+                    table_name=table_name,
+                    total_rows=total_rows,
+                    columns_summary=columns_summary
+                )
             
             description = result.description.strip()
             return description[:997] + "..." if len(description) > 1000 else description
@@ -170,78 +281,102 @@ class MetadataEnricher:
         
         logger.info(f"📊 Loaded {len(df_full)} total rows, processing {len(df_to_process)} rows")
         
-        # Group by table (only for rows to process)
-        tables = {}
-        for _, row in df_to_process.iterrows():
-            table_name = row['table_name']
-            if table_name not in tables:
-                tables[table_name] = []
-            tables[table_name].append(row.to_dict())
+        # Group by table (only for rows to process), keeping file order
+        tables = {
+            table_name: group.to_dict('records')
+            for table_name, group in df_to_process.groupby('table_name', sort=False)
+        }
         
         logger.info(f"🗂️  Found {len(tables)} unique tables")
         
         # Process tables
         all_results = []
+        column_descriptions = {}
+        table_descriptions = {}
         
-        for table_idx, (table_name, columns) in enumerate(tables.items(), 1):
-            progress = (table_idx / len(tables)) * 100
-            logger.info(f"🔍 Processing table {table_idx}/{len(tables)} ({progress:.0f}%): {table_name}")
+        # One pool for every column across all tables, sized to the provider's concurrency
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {}   # future -> [(table_name, col), ...] sharing its result; the first was submitted
+            inflight = {}  # column signature -> future
             
-            # Generate table description
-            columns_summary = self._create_columns_summary(columns)
-            table_description = self.table_describer(
-                table_name=table_name,
-                total_rows=columns[0]['total_rows'],
-                columns_summary=columns_summary
-            )
+            for table_name, columns in tables.items():
+                for col in columns:
+                    signature = _column_signature(col)
+                    future = inflight.get(signature)
+                    if future is None:
+                        future = executor.submit(
+                            self.column_describer,
+                            table_name=col['table_name'],
+                            column_name=col['column_name'],
+                            data_type=col['data_type'],
+                            cardinality=col['cardinality'],
+                            cardinality_level=col['cardinality_level'],
+                            total_rows=col['total_rows'],
+                            primary_key=col['primary_key'],
+                            distinct_values=col['distinct_values'],
+                            neighboring_columns=col['neighbouring_columns']
+                        )
+                        inflight[signature] = future
+                    futures.setdefault(future, []).append((table_name, col))
             
-            # Generate column descriptions in parallel
-            column_descriptions = {}
+            total_columns = sum(len(members) for members in futures.values())
+            if len(futures) < total_columns:
+                logger.info(f"♻️  {total_columns - len(futures)} columns share a description with an identical column")
             
-            with ThreadPoolExecutor(max_workers=max_workers) as executor:
-                futures = {}
+            # Table descriptions are generated here while column descriptions are in flight
+            for table_idx, (table_name, columns) in enumerate(tables.items(), 1):
+                progress = (table_idx / len(tables)) * 100
+                logger.info(f"🔍 Processing table {table_idx}/{len(tables)} ({progress:.0f}%): {table_name}")
                 
-                for col in columns:
-                    future = executor.submit(
-                        self.column_describer,
-                        table_name=col['table_name'],
-                        column_name=col['column_name'],
-                        data_type=col['data_type'],
-                        cardinality=col['cardinality'],
-                        cardinality_level=col['cardinality_level'],
-                        total_rows=col['total_rows'],
-                        primary_key=col['primary_key'],
-                        distinct_values=col['distinct_values'],
-                        neighboring_columns=col['neighbouring_columns']
+                # Generate table description
+                columns_summary = self._create_columns_summary(columns)
+                table_descriptions[table_name] = self.table_describer(
+                    table_name=table_name,
+                    total_rows=columns[0]['total_rows'],
+                    columns_summary=columns_summary
+                )
+            
+            completed_columns = 0
+            
+            for future in as_completed(futures):
+                members = futures[future]
+                completed_columns += len(members)
+                table_name, col_name = members[0][0], members[0][1]['column_name']
+                
+                try:
+                    description = future.result()
+                    
+                    # Show column progress in verbose mode (formatted lazily)
+                    logger.debug(
+                        "     ✅ Column %d/%d (%.0f%%): %s.%s",
+                        completed_columns, total_columns, completed_columns / total_columns * 100,
+                        table_name, col_name
                     )
-                    futures[future] = col['column_name']
+                except Exception as e:
+                    logger.error(f"❌ Failed to process {table_name}.{col_name}: {e}")
+                    description = "Description generation failed"
                 
-                completed_columns = 0
-                total_columns = len(columns)
+                for member_table, col in members:
+                    column_descriptions[(member_table, col['column_name'])] = description
                 
-                for future in as_completed(futures):
-                    col_name = futures[future]
-                    completed_columns += 1
-                    
-                    try:
-                        description = future.result()
-                        column_descriptions[col_name] = description
-                        
-                        # Show column progress in verbose mode
-                        col_progress = (completed_columns / total_columns) * 100
-                        logger.debug(f"     ✅ Column {completed_columns}/{total_columns} ({col_progress:.0f}%): {col_name}")
-                        
-                        time.sleep(0.1)  # Rate limiting
-                    except Exception as e:
-                        logger.error(f"❌ Failed to process {col_name}: {e}")
-                        column_descriptions[col_name] = "Description generation failed"
-            
-            # Combine results
+                # The submitted column cached itself; give deduped columns their own entries
+                if description != "Description generation failed":
+                    for member_table, col in members[1:]:
+                        _write_cached_description(_description_cache_path(member_table, col), description)
+        
+        # Combine results, tracking description lengths for the final report
+        max_col_len = 0
+        max_table_len = 0
+        for table_name, columns in tables.items():
+            table_description = table_descriptions[table_name]
+            max_table_len = max(max_table_len, len(table_description))
             for col in columns:
-                result_row = col.copy()
-                result_row['column_description'] = column_descriptions[col['column_name']]
-                result_row['table_description'] = table_description
-                all_results.append(result_row)
+                # Records from to_dict('records') are fresh dicts, so they can be filled in place
+                column_description = column_descriptions[(table_name, col['column_name'])]
+                max_col_len = max(max_col_len, len(column_description))
+                col['column_description'] = column_description
+                col['table_description'] = table_description
+                all_results.append(col)
         
         # In test mode, merge enriched results with original data
         if test_mode:
@@ -254,12 +389,16 @@ class MetadataEnricher:
             if 'table_description' not in df_full.columns:
                 df_full['table_description'] = ''
             
-            # Update only the processed rows with enriched data
-            for _, enriched_row in enriched_df.iterrows():
-                mask = (df_full['table_name'] == enriched_row['table_name']) & \
-                       (df_full['column_name'] == enriched_row['column_name'])
-                df_full.loc[mask, 'column_description'] = enriched_row['column_description']
-                df_full.loc[mask, 'table_description'] = enriched_row['table_description']
+            # Update only the processed rows with enriched data (single join on the row key)
+            key_columns = ['table_name', 'column_name']
+            description_columns = ['column_description', 'table_description']
+            df_full = df_full.merge(
+                enriched_df[key_columns + description_columns],
+                on=key_columns, how='left', suffixes=('', '_new')
+            )
+            for col in description_columns:
+                df_full[col] = df_full[f'{col}_new'].combine_first(df_full[col])
+            df_full = df_full.drop(columns=[f'{col}_new' for col in description_columns])
             
             # Save the full dataframe with partial enrichment
             df_full.to_csv(output_file, index=False)
@@ -275,9 +414,6 @@ class MetadataEnricher:
         logger.info(f"📊 Processed {len(tables)} tables, {len(all_results)} columns")
         
         # Verify character limits
-        max_col_len = enriched_df['column_description'].str.len().max()
-        max_table_len = enriched_df['table_description'].str.len().max()
-        
         logger.info(f"📏 Max column description length: {max_col_len} characters")
         logger.info(f"📏 Max table description length: {max_table_len} characters")
         
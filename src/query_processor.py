@@ -1,24 +1,159 @@
 # src/query_processor.py
 from typing import Dict, Any, Optional
 import os
+import atexit
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from collections import OrderedDict, defaultdict
 from datetime import datetime
+from heapq import nlargest
 from src.dspy_modules import QueryRephrasingModule, SQLGenerationModule, SQLSafetyCheckModule
 from src.vector_store import VectorStore
+from src.learnings_index import LearningsIndex, SUCCESSFUL_QUERIES_FILE, parse_learnings_file
+from src.sql_safety import static_safety_check
 from src.config import Config
 import re
 
+# Patterns used by clean_sql and table extraction, compiled once.
+# _RE_CLEAN strips markdown fences, stray backticks, and -- / /* */ comments in one pass
+_RE_CLEAN = re.compile(r'```sql\s*|```\s*|`+|--[^\n]*|/\*.*?\*/', re.DOTALL)
+_RE_WS = re.compile(r'\s+')
+_RE_TABLES = re.compile(r'(?:FROM|JOIN)\s+(\w+)', re.IGNORECASE)
+_RE_WORD = re.compile(r'\w+')
+
 class QueryProcessor:
     """Processes user queries and generates SQL"""
     
-    def __init__(self, verbose: bool = True):
-        self.vector_store = VectorStore(verbose=verbose)
+    # Formatted schema block per table, keyed by (path, mtime) so a regenerated file is reloaded
+    _METADATA_CACHE: Dict[tuple, Dict[str, str]] = {}
+    
+    # Entries kept in each per-instance LRU (retrieved context, rephrased queries)
+    _LRU_SIZE = 64
+    
+    def __init__(self, verbose: bool = True, vector_store: Optional[VectorStore] = None):
+        self.verbose = verbose
+        self.vector_store = vector_store or VectorStore(verbose=verbose)
         self.rephrase_module = QueryRephrasingModule()
         self.sql_module = SQLGenerationModule()
         self.safety_module = SQLSafetyCheckModule()
+        self._load_metadata()
         
         # Conversation history - store last 5 conversations
         self.conversation_history = []
         self.max_history = 5
+        
+        # Formatted history is rebuilt only after the history changes
+        self._context_cache = ""
+        self._context_dirty = False
+        
+        # Repeated queries (e.g. during refinement) skip the vector search and the rephrase call
+        self._ctx_cache: OrderedDict = OrderedDict()
+        self._rephrase_cache: OrderedDict = OrderedDict()
+        
+        # Successful-query entries are appended to disk by a background writer
+        self._store_queue = queue.Queue()
+        self._store_thread = threading.Thread(target=self._store_worker, daemon=True)
+        self._store_thread.start()
+        self._closed = False
+        atexit.register(self.close)
+        
+        # Runs the learnings lookup alongside the schema search
+        self._io_executor = ThreadPoolExecutor(max_workers=2)
+        
+        # Parsed learnings file for the keyword fallback: (title, insight) blocks plus
+        # an inverted index from title token to block ids. Parsed once, then extended
+        # in memory as queries are stored (the file only grows by append)
+        self._learning_blocks = []
+        self._token_index = defaultdict(set)
+        if os.path.exists(SUCCESSFUL_QUERIES_FILE):
+            for title, insight in parse_learnings_file(SUCCESSFUL_QUERIES_FILE):
+                self._index_learning(title, insight)
+        
+        # Local semantic search over the same blocks (exact scan, HNSW once large)
+        self._learnings_index = LearningsIndex(self._learning_blocks)
+    
+    def _store_worker(self) -> None:
+        """Append queued successful-query entries to the learnings file
+        
+        Files stay open for the life of the worker; buffered writes are flushed
+        whenever the queue drains, so other readers see complete entries.
+        """
+        handles = {}
+        try:
+            while True:
+                item = self._store_queue.get()
+                if item is None:
+                    break
+                path, entry = item
+                try:
+                    f = handles.get(path)
+                    if f is None:
+                        f = handles[path] = open(path, 'a', encoding='utf-8', buffering=8192)
+                    f.write(entry)
+                    if self._store_queue.empty():
+                        f.flush()
+                except Exception as e:
+                    if self.verbose:
+                        print(f"Warning: Could not store successful query: {e}")
+        finally:
+            for f in handles.values():
+                f.close()
+    
+    def close(self, timeout: float = 5.0) -> None:
+        """Wait (up to timeout seconds) for pending background writes to finish"""
+        if self._closed:
+            return
+        self._closed = True
+        self._io_executor.shutdown(wait=False)
+        self._store_queue.put(None)
+        self._store_thread.join(timeout)
+    
+    @classmethod
+    def _load_metadata(cls) -> Dict[str, str]:
+        """Return the formatted schema block for each table, reading the CSV only when it changed"""
+        path = Config.METADATA_FILE
+        try:
+            key = (path, os.path.getmtime(path))
+        except OSError:
+            return {}
+        
+        cached = cls._METADATA_CACHE.get(key)
+        if cached is None:
+            df = pd.read_csv(path)
+            cached = {}
+            for name, group in df.groupby('table_name', sort=False):
+                column_lines = "".join(
+                    f"  - {row.column_name} ({row.data_type}): {row.column_description}\n"
+                    for row in group.itertuples(index=False)
+                )
+                cached[name] = (
+                    f"Table: {name}\n"
+                    f"Description: {group['table_description'].iloc[0]}\n"
+                    f"Columns:\n{column_lines}\n"
+                )
+            cls._METADATA_CACHE.clear()
+            cls._METADATA_CACHE[key] = cached
+        return cached
+    
+    @property
+    def _table_blocks(self) -> Dict[str, str]:
+        return self._load_metadata()
+    
+    def _lru_get(self, cache: OrderedDict, key):
+        """Return a cached value (marking it recently used), or None"""
+        value = cache.get(key)
+        if value is not None:
+            cache.move_to_end(key)
+        return value
+    
+    def _lru_put(self, cache: OrderedDict, key, value) -> None:
+        """Store a value, evicting the least recently used entry when full"""
+        cache[key] = value
+        cache.move_to_end(key)
+        if len(cache) > self._LRU_SIZE:
+            cache.popitem(last=False)
     
     def add_to_conversation_history(self, user_query: str, sql_query: str, user_feedback: str = "", was_successful: bool = True):
         """Add a conversation to history, maintaining max_history limit"""
@@ -35,24 +170,34 @@ class QueryProcessor:
         # Keep only the last max_history conversations
         if len(self.conversation_history) > self.max_history:
             self.conversation_history.pop(0)
+        
+        self._context_dirty = True
+    
+    def clear_conversation_history(self) -> None:
+        """Forget all previous conversations"""
+        self.conversation_history.clear()
+        self._context_cache = ""
+        self._context_dirty = False
     
     def get_conversation_context(self) -> str:
         """Get formatted conversation history as context"""
-        if not self.conversation_history:
-            return ""
+        if not self._context_dirty:
+            return self._context_cache
         
-        context = "\n--- Previous Conversation History ---\n"
+        parts = ["\n--- Previous Conversation History ---\n"]
         for i, conv in enumerate(self.conversation_history, 1):
-            context += f"\nConversation {i}:\n"
-            context += f"User Query: {conv['user_query']}\n"
-            context += f"Generated SQL: {conv['sql_query']}\n"
+            parts.append(f"\nConversation {i}:\n")
+            parts.append(f"User Query: {conv['user_query']}\n")
+            parts.append(f"Generated SQL: {conv['sql_query']}\n")
             if conv['user_feedback']:
-                context += f"User Feedback: {conv['user_feedback']}\n"
-            context += f"Status: {'Successful' if conv['was_successful'] else 'Not completed'}\n"
-            context += f"Time: {conv['timestamp']}\n"
-        
-        context += "\n--- End of Previous Conversations ---\n\n"
-        return context
+                parts.append(f"User Feedback: {conv['user_feedback']}\n")
+            parts.append(f"Status: {'Successful' if conv['was_successful'] else 'Not completed'}\n")
+            parts.append(f"Time: {conv['timestamp']}\n")
+        
+        parts.append("\n--- End of Previous Conversations ---\n\n")
+        self._context_cache = "".join(parts)
+        self._context_dirty = False
+        return self._context_cache
     
     def show_conversation_history(self):
         """Display conversation history to the user"""
@@ -82,65 +227,68 @@ class QueryProcessor:
         if conversation_context:
             full_context = conversation_context + context
         
-        result = self.rephrase_module(user_query=user_query, context=full_context)
-        return result['rephrased_query']
+        key = (user_query, hash(full_context))
+        rephrased = self._lru_get(self._rephrase_cache, key)
+        if rephrased is None:
+            result = self.rephrase_module(user_query=user_query, context=full_context)
+            rephrased = result['rephrased_query']
+            self._lru_put(self._rephrase_cache, key, rephrased)
+        return rephrased
     
 
     
     def retrieve_relevant_context(self, query: str) -> str:
         """Retrieve relevant context from knowledge base - top 20 tables with all their columns plus query learnings"""
+        # Keyed on the metadata file's mtime so regenerated metadata is picked up
+        try:
+            schema_version = os.path.getmtime(Config.METADATA_FILE)
+        except OSError:
+            schema_version = None
+        key = (query, schema_version)
+        
+        context = self._lru_get(self._ctx_cache, key)
+        if context is None:
+            context = self._build_relevant_context(query)
+            self._lru_put(self._ctx_cache, key, context)
+        return context
+    
+    def _build_relevant_context(self, query: str) -> str:
+        """Search the knowledge base and format the schema and learnings context for a query"""
+        # The learnings lookup doesn't depend on the schema search, so both MindsDB calls run concurrently
+        learnings_future = self._io_executor.submit(self._get_relevant_query_learnings, query)
+        
         # First get relevant columns to identify tables
-        context_data = self.vector_store.search(query, top_k=50)
+        try:
+            context_data = self.vector_store.search(query, top_k=50)
+        except Exception:
+            learnings_future.cancel()
+            raise
         
-        # Get unique table names from search results, ranked by relevance
-        table_relevance = {}
+        # Get unique table names from search results, keeping the highest relevance score for each table
+        table_relevance = defaultdict(float)
         for item in context_data:
             table_name = item['metadata']['table_name']
-            if table_name not in table_relevance:
-                table_relevance[table_name] = item['relevance']
-            else:
-                # Keep the highest relevance score for each table
-                table_relevance[table_name] = max(table_relevance[table_name], item['relevance'])
-        
-        # Sort tables by relevance and take top 20
-        top_tables = sorted(table_relevance.items(), key=lambda x: x[1], reverse=True)[:20]
-        top_table_names = [table[0] for table in top_tables]
+            relevance = item['relevance']
+            if relevance > table_relevance[table_name]:
+                table_relevance[table_name] = relevance
         
-        # Now get ALL columns for these top 20 tables from the metadata file
-        import pandas as pd
-        from src.config import Config
+        # Take the top 20 tables by relevance (ties keep search order, as with a stable sort)
+        top_table_names = [name for name, _ in nlargest(20, table_relevance.items(), key=lambda x: x[1])]
         
-        df = pd.read_csv(Config.METADATA_FILE)
+        # Now get ALL columns for these top 20 tables, preformatted when the metadata was loaded
+        table_blocks = self._table_blocks
         
-        context_str = "Available Database Schema (Top 20 most relevant tables):\n\n"
-        
-        for table_name in top_table_names:
-            table_data = df[df['table_name'] == table_name]
-            if not table_data.empty:
-                # Get table description
-                table_desc = table_data.iloc[0]['table_description']
-                
-                context_str += f"Table: {table_name}\n"
-                context_str += f"Description: {table_desc}\n"
-                context_str += "Columns:\n"
-                
-                # Add all columns for this table
-                for _, row in table_data.iterrows():
-                    col_name = row['column_name']
-                    col_type = row['data_type']
-                    col_desc = row['column_description']
-                    context_str += f"  - {col_name} ({col_type}): {col_desc}\n"
-                
-                context_str += "\n"
+        parts = ["Available Database Schema (Top 20 most relevant tables):\n\n"]
+        parts.extend(table_blocks[name] for name in top_table_names if name in table_blocks)
         
         # Add relevant query learnings
-        query_learnings = self._get_relevant_query_learnings(query)
+        query_learnings = learnings_future.result()
         if query_learnings:
-            context_str += "\n--- Previous Successful Query Patterns ---\n"
-            context_str += query_learnings
-            context_str += "\n--- End Query Patterns ---\n\n"
+            parts.append("\n--- Previous Successful Query Patterns ---\n")
+            parts.append(query_learnings)
+            parts.append("\n--- End Query Patterns ---\n\n")
         
-        return context_str
+        return "".join(parts)
     
     def generate_sql(self, rephrased_query: str, context: str, user_feedback: str = "", previous_queries: str = "") -> str:
         """Generate SQL from query and context, optionally with user feedback"""
@@ -161,7 +309,16 @@ class QueryProcessor:
         return self.clean_sql(result.sql_query)
     
     def check_sql_safety(self, sql_query: str) -> Dict[str, Any]:
-        """Check SQL for dangerous operations"""
+        """Check SQL for dangerous operations
+        
+        Known write/DDL keywords are rejected, and plain read-only statements
+        accepted, without an LLM call; other queries (including any using a
+        table function or system table) are checked by the LLM.
+        """
+        verdict = static_safety_check(sql_query)
+        if verdict is not None:
+            return verdict
+        
         result = self.safety_module(sql_query=sql_query)
         is_safe = result.is_safe.lower() == "true"
         reason = result.reason if not is_safe else "Query is safe"
@@ -171,15 +328,18 @@ class QueryProcessor:
             'reason': reason
         }
     
-    def store_successful_query(self, user_query: str, sql_query: str, user_feedback: str = "", query_results: list = None) -> None:
-        """Store a successful query with learnings and add to RAG system"""
-        successful_queries_file = "data/successful_queries.md"
+    def store_successful_query(self, user_query: str, sql_query: str, user_feedback: str = "", query_results: list = None, row_count: Optional[int] = None) -> None:
+        """Store a successful query with learnings and add to RAG system
+        
+        query_results should be a small sample; pass the full result size as row_count.
+        """
+        successful_queries_file = SUCCESSFUL_QUERIES_FILE
         
         # Extract tables used from SQL
         tables_used = self._extract_tables_from_sql(sql_query)
         
         # Generate learning insights from the conversation
-        learning_insights = self._extract_learning_insights(user_query, sql_query, user_feedback)
+        learning_insights = self._extract_learning_insights(user_query, sql_query, user_feedback, tables_used)
         
         # Create the entry with essential information only
         entry = f"""
@@ -188,6 +348,9 @@ class QueryProcessor:
 **Tables:** {', '.join(tables_used) if tables_used else 'N/A'}
 """
         
+        if row_count is not None:
+            entry += f"**Rows:** {row_count}\n"
+        
         if user_feedback:
             entry += f"**Learning:** {user_feedback}\n"
         
@@ -196,9 +359,16 @@ class QueryProcessor:
         
         entry += "\n---\n"
         
-        # Append to file
-        with open(successful_queries_file, 'a', encoding='utf-8') as f:
-            f.write(entry)
+        # Append to file in the background so the caller isn't blocked on disk
+        self._store_queue.put((successful_queries_file, entry))
+        
+        # Keep the in-memory learnings in step with the file: the first insight line wins
+        insight = user_feedback or learning_insights
+        if insight:
+            self._index_learning(user_query.strip(), insight)
+        
+        # Cached contexts may include learnings from before this entry
+        self._ctx_cache.clear()
         
         # Add to RAG system for future queries
         self._add_to_knowledge_base(user_query, sql_query, tables_used, learning_insights, user_feedback)
@@ -214,31 +384,37 @@ class QueryProcessor:
     def _extract_tables_from_sql(self, sql_query: str) -> list:
         """Extract table names from SQL query"""
         # Simple regex to find table names after FROM and JOIN
-        pattern = r'(?:FROM|JOIN)\s+(\w+)'
-        matches = re.findall(pattern, sql_query, re.IGNORECASE)
+        matches = _RE_TABLES.findall(sql_query)
         
         # Remove duplicates and return
         return list(set(matches))
     
-    def _extract_learning_insights(self, user_query: str, sql_query: str, user_feedback: str) -> str:
+    def _extract_learning_insights(self, user_query: str, sql_query: str, user_feedback: str, tables_used: Optional[list] = None) -> str:
         """Extract key learning insights from the successful query interaction"""
         insights = []
         
+        # Lower each string once; user query words are matched as tokens
+        query_tokens = set(_RE_WORD.findall(user_query.lower()))
+        sql_lower = sql_query.lower()
+        if tables_used is None:
+            tables_used = self._extract_tables_from_sql(sql_query)
+        
         # Analyze query patterns
-        if "top" in user_query.lower() and "limit" in sql_query.lower():
+        if "top" in query_tokens and "limit" in sql_lower:
             insights.append("Uses LIMIT for top N queries")
         
-        if "revenue" in user_query.lower() and "sum" in sql_query.lower():
+        if "revenue" in query_tokens and "sum" in sql_lower:
             insights.append("Revenue queries typically use SUM aggregation")
         
-        if len(self._extract_tables_from_sql(sql_query)) > 1:
+        if len(tables_used) > 1:
             insights.append("Multi-table joins required for this type of query")
         
         # Add user feedback insights
         if user_feedback:
-            if "join" in user_feedback.lower():
+            feedback_lower = user_feedback.lower()
+            if "join" in feedback_lower:
                 insights.append("User needed clarification on table relationships")
-            if "group" in user_feedback.lower():
+            if "group" in feedback_lower:
                 insights.append("Grouping logic was important for this query")
         
         return "; ".join(insights) if insights else ""
@@ -246,7 +422,16 @@ class QueryProcessor:
     def _get_relevant_query_learnings(self, query: str) -> str:
         """Get relevant query learnings from successful queries using vector search"""
         try:
-            # First try to search learnings knowledge base
+            # Search the local index first: no MindsDB round trip
+            try:
+                local_results = self._learnings_index.search(query, top_k=3)
+                if local_results:
+                    return "\n".join(f"Similar query '{title}': {insight}" for title, insight in local_results)
+            except Exception as e:
+                if self.verbose:
+                    print(f"Warning: Local learnings search failed: {e}")
+            
+            # Then try to search learnings knowledge base
             learnings_results = self.vector_store.search_learnings(query, top_k=3)
             
             if learnings_results:
@@ -260,45 +445,28 @@ class QueryProcessor:
                 if relevant_learnings:
                     return "\n".join(relevant_learnings)
             
-            # Fallback to file-based search using successful_queries.md
-            if not os.path.exists("data/successful_queries.md"):
-                return ""
-            
-            with open("data/successful_queries.md", 'r', encoding='utf-8') as f:
-                content = f.read()
+            # Fallback to keyword search over the learnings parsed from successful_queries.md
+            # Examples whose title shares a keyword with the query, in file order
+            # One hash lookup per query word; punctuation is stripped on both sides of the index
+            query_keywords = {keyword for keyword in _RE_WORD.findall(query.lower()) if len(keyword) > 2}
+            candidates = set().union(*(self._token_index[k] for k in query_keywords if k in self._token_index))
             
-            # Extract relevant patterns based on query keywords
-            query_lower = query.lower()
-            relevant_learnings = []
-            
-            # Split into individual query examples
-            examples = content.split("### ")[1:]  # Skip header
-            
-            for example in examples:
-                lines = example.strip().split('\n')
-                if not lines:
-                    continue
-                
-                query_title = lines[0].strip()
-                
-                # Check if this example is relevant to current query
-                if any(keyword in query_title.lower() for keyword in query_lower.split() if len(keyword) > 2):
-                    # Extract insights from Learning or Key Insight lines
-                    for line in lines:
-                        if line.startswith("**Learning:**"):
-                            insight = line.replace("**Learning:**", "").strip()
-                            relevant_learnings.append(f"Similar query '{query_title}': {insight}")
-                            break
-                        elif line.startswith("**Key Insight:**"):
-                            insight = line.replace("**Key Insight:**", "").strip()
-                            relevant_learnings.append(f"Similar query '{query_title}': {insight}")
-                            break
-            
-            return "\n".join(relevant_learnings[:3])  # Limit to top 3 most relevant
+            relevant_learnings = [
+                "Similar query '{}': {}".format(*self._learning_blocks[block_id])
+                for block_id in sorted(candidates)[:3]  # Limit to top 3 most relevant
+            ]
+            return "\n".join(relevant_learnings)
             
         except Exception as e:
             return ""
     
+    def _index_learning(self, title: str, insight: str) -> None:
+        """Add one (title, insight) block to the learnings index"""
+        block_id = len(self._learning_blocks)
+        self._learning_blocks.append((title, insight))
+        for token in set(_RE_WORD.findall(title.lower())):
+            self._token_index[token].add(block_id)
+    
     def _add_to_knowledge_base(self, user_query: str, sql_query: str, tables_used: list, learning_insights: str, user_feedback: str) -> None:
         """Add successful query learnings to the knowledge base for future reference"""
         try:
@@ -315,20 +483,9 @@ class QueryProcessor:
         if not sql_query:
             return sql_query
         
-        # Remove markdown code blocks (```sql and ```)
-        cleaned = re.sub(r'```sql\s*', '', sql_query)
-        cleaned = re.sub(r'```\s*', '', cleaned)
-        
-        # Remove any remaining backticks
-        cleaned = re.sub(r'`+', '', cleaned)
-        
-        # Remove SQL comments (-- style and /* */ style)
-        cleaned = re.sub(r'--.*?(?=\n|$)', '', cleaned)  # Single line comments
-        cleaned = re.sub(r'/\*.*?\*/', '', cleaned, flags=re.DOTALL)  # Multi-line comments
-        
-        # Remove extra whitespace and normalize line breaks
-        cleaned = re.sub(r'\s+', ' ', cleaned)
-        cleaned = cleaned.strip()
+        # Remove markdown code blocks, remaining backticks and SQL comments,
+        # then collapse whitespace and normalize line breaks
+        cleaned = _RE_WS.sub(' ', _RE_CLEAN.sub('', sql_query)).strip()
         
         return cleaned
     
@@ -337,7 +494,11 @@ class QueryProcessor:
     def collect_post_execution_feedback(self, user_query: str, sql_query: str, user_feedback: str = "", query_results: list = None) -> bool:
         """Collect feedback after query execution with 3-path system"""
         print("\n" + "="*50)
-        feedback = input("Rate this query: (g)ood / (f)ix / (w)rong: ").lower().strip()
+        while True:
+            feedback = input("Rate this query: (g)ood / (f)ix / (w)rong: ").lower().strip()
+            if feedback in ('g', 'f', 'w'):
+                break
+            print("Please enter 'g', 'f', or 'w'")
         
         if feedback == 'g':
             print("✅ Great! Storing this successful query for future reference.")
@@ -351,7 +512,7 @@ class QueryProcessor:
             refinement_feedback = f"Query needed refinement: {refinement}"
             self.store_successful_query(user_query, sql_query, refinement_feedback, query_results)
             return False
-        elif feedback == 'w':
+        else:
             failure_reason = input("What went wrong? (optional): ").strip()
             print("🔄 Thanks for the feedback. Please try rephrasing your question.")
             if failure_reason:
@@ -360,9 +521,6 @@ class QueryProcessor:
                 failure_feedback = f"Query failed because: {failure_reason}"
                 # Don't store as successful, but could log for learning
             return False
-        else:
-            print("Please enter 'g', 'f', or 'w'")
-            return self.collect_post_execution_feedback(user_query, sql_query, user_feedback, query_results)
     
     def process_query_with_refinement(self, user_query: str, refinement_context: str = "", max_iterations: int = 2) -> Dict[str, Any]:
         """Process query with iterative refinement support"""
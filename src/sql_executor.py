@@ -3,14 +3,23 @@ import clickhouse_connect
 from typing import List, Dict, Any, Optional
 from src.config import Config
 import logging
+import re
 
 logger = logging.getLogger(__name__)
 
+# Previews wrap only plain SELECT/WITH queries in a LIMIT subquery; a trailing
+# FORMAT/SETTINGS clause can't sit inside a subquery
+_RE_WRAPPABLE = re.compile(r'^\s*(SELECT|WITH)\b', re.IGNORECASE)
+_RE_TRAILING_CLAUSE = re.compile(r'\b(FORMAT|SETTINGS)\b[^()]*$', re.IGNORECASE)
+
 class SQLExecutor:
     """Executes SQL queries against ClickHouse"""
     
+    __slots__ = ('client', 'last_error')
+    
     def __init__(self):
         self.client = None
+        self.last_error: Optional[str] = None  # Why the last execute_query returned None
         self._connect()
     
     def _connect(self):
@@ -23,30 +32,72 @@ class SQLExecutor:
             logger.error(f"❌ Failed to connect to ClickHouse: {e}")
             raise
     
-    def execute_query(self, sql_query: str) -> Optional[List[Dict[str, Any]]]:
-        """Execute SQL query and return results"""
+    def execute_query(self, sql_query: str, preview: bool = False) -> Optional[List[Dict[str, Any]]]:
+        """Execute SQL query and return results
+        
+        With preview=True only Config.PREVIEW_ROWS + 1 rows are fetched, so callers
+        can tell whether more rows exist without pulling the full result set.
+        On failure None is returned and the error is kept in last_error.
+        """
+        self.last_error = None
         try:
             if not self.client:
                 self._connect()
             
+            if preview:
+                return self._preview(sql_query.strip().rstrip(';'), Config.PREVIEW_ROWS + 1)
+            
             logger.info(f"Executing query: {sql_query}")
             result = self.client.query(sql_query)
             
             # Convert to list of dictionaries
-            if result.result_rows:
-                columns = result.column_names
-                rows = []
-                for row in result.result_rows:
-                    row_dict = dict(zip(columns, row))
-                    rows.append(row_dict)
-                return rows
-            else:
-                return []
+            columns = result.column_names
+            return [dict(zip(columns, row)) for row in result.result_rows]
                 
         except Exception as e:
+            self.last_error = str(e)
             logger.error(f"❌ Query execution failed: {e}")
             return None
     
+    def _preview(self, sql_query: str, limit: int) -> List[Dict[str, Any]]:
+        """First `limit` rows of a query
+        
+        SELECT/WITH queries are wrapped in a LIMIT so the server stops early. Other
+        statements (SHOW, DESCRIBE, EXPLAIN), and queries the wrapper breaks, run
+        as written and are streamed until `limit` rows have arrived.
+        """
+        if _RE_WRAPPABLE.match(sql_query) and not _RE_TRAILING_CLAUSE.search(sql_query):
+            wrapped = f"SELECT * FROM ({sql_query}) LIMIT {limit}"
+            logger.info(f"Executing query: {wrapped}")
+            try:
+                result = self.client.query(wrapped)
+                return [dict(zip(result.column_names, row)) for row in result.result_rows]
+            except Exception as e:
+                # e.g. duplicate column names in the subquery; the query itself may still run
+                logger.warning(f"Preview wrapper failed, running the query as written: {e}")
+        
+        logger.info(f"Executing query: {sql_query}")
+        rows = []
+        with self.client.query_row_block_stream(sql_query) as stream:
+            columns = stream.source.column_names
+            for block in stream:
+                rows.extend(dict(zip(columns, row)) for row in block[:limit - len(rows)])
+                if len(rows) >= limit:
+                    break
+        return rows
+    
+    def get_table_schema(self, table_name: str) -> Dict[str, str]:
+        """Get column name -> type for a table"""
+        try:
+            if not self.client:
+                self._connect()
+            
+            result = self.client.query(f"DESCRIBE TABLE {table_name}")
+            return {row[0]: row[1] for row in result.result_rows}
+        except Exception as e:
+            logger.error(f"❌ Error getting table schema: {e}")
+            return {}
+    
     def test_connection(self) -> bool:
         """Test ClickHouse connection"""
         try:
@@ -0,0 +1,65 @@
+# src/sql_safety.py
+import re
+from typing import Any, Dict, Optional
+
+# String literals, quoted identifiers ("..." or `...`) and comments, matched in one
+# left-to-right pass so a quote character inside one of them can't start another
+_RE_LITERALS = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"|`(?:[^`\\]|\\.)*`|--[^\n]*|/\*.*?\*/", re.DOTALL)
+_RE_WS = re.compile(r'\s+')
+
+# Deterministic safety verdicts; anything else still goes to the LLM check
+_RE_DANGEROUS = re.compile(
+    r'\b(DROP|TRUNCATE|ALTER|GRANT|REVOKE|(?<!SHOW )CREATE|INSERT|UPDATE|DELETE|RENAME|ATTACH|DETACH|INTO OUTFILE)\b',
+    re.IGNORECASE
+)
+_RE_READ_ONLY = re.compile(r'^(SELECT|WITH|SHOW|DESCRIBE|DESC|EXPLAIN)\b', re.IGNORECASE)
+
+# Table functions (which can read server files, open connections or run programs)
+# and system tables are never accepted without the LLM check
+_RE_NEEDS_REVIEW = re.compile(
+    r'\b(?:FROM|JOIN) \w+ ?\('
+    r'|\b(?:file|url|urlCluster|s3|s3Cluster|gcs|hdfs|azureBlobStorage|remote|remoteSecure|cluster|clusterAllReplicas'
+    r'|mysql|postgresql|mongodb|sqlite|jdbc|odbc|executable) ?\('
+    r'|\bsystem ?\.',
+    re.IGNORECASE
+)
+
+def _strip_literals(sql_query: str, unquote_identifiers: bool = False) -> str:
+    """SQL with string literals emptied, comments removed and whitespace collapsed
+
+    Quoted identifiers are emptied too, so a column named "drop" isn't a keyword;
+    with unquote_identifiers they keep their name instead ("system".users -> system.users).
+    """
+    def replace(match):
+        token = match.group(0)
+        if token[0] == "'":
+            return "''"
+        if token[0] in '"`':
+            return token[1:-1] if unquote_identifiers else '""'
+        return ' '
+    return _RE_WS.sub(' ', _RE_LITERALS.sub(replace, sql_query)).strip()
+
+def static_safety_check(sql_query: str) -> Optional[Dict[str, Any]]:
+    """Decide safety from the SQL text alone, or return None if the LLM must judge
+
+    Known write/DDL keywords are rejected, and single read-only statements that
+    use no table function or system table are accepted.
+    """
+    code = _strip_literals(sql_query)
+
+    match = _RE_DANGEROUS.search(code)
+    if match:
+        return {
+            'is_safe': False,
+            'reason': f"Contains {match.group(1).upper()}"
+        }
+
+    if _RE_NEEDS_REVIEW.search(_strip_literals(sql_query, unquote_identifiers=True)):
+        return None
+
+    if _RE_READ_ONLY.match(code) and ';' not in code.rstrip(';'):
+        return {
+            'is_safe': True,
+            'reason': "Query is safe"
+        }
+    return None
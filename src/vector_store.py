@@ -2,30 +2,77 @@
 import pandas as pd
 import mindsdb_sdk
 import os
+import queue
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
 from typing import Optional
 from src.config import Config
 
+# Fields of each record in the learnings knowledge base
+LEARNINGS_COLUMNS = ['id', 'query_pattern', 'sql_solution', 'tables_involved', 'learning', 'user_feedback']
+
 class VectorStore:
     """Handles vector storage and retrieval using MindsDB"""
     
+    __slots__ = ('connection', 'kb_name', 'verbose', '_pool', '_pool_created', '_pool_lock')
+    
     def __init__(self, verbose: bool = True):
         self.connection = None
         self.kb_name = Config.KB_NAME
         self.verbose = verbose
+        
+        # Idle connections for concurrent searches; grows lazily up to MINDSDB_POOL_SIZE
+        self._pool = queue.Queue()
+        self._pool_created = 0
+        self._pool_lock = threading.Lock()
     
     def connect(self) -> None:
         """Connect to MindsDB"""
-        if not self.connection:
-            # Validate configuration first
-            if not Config.validate_mindsdb_config():
-                raise ValueError("Invalid MindsDB configuration")
-            
-            params = Config.get_mindsdb_connection_params()
-            if self.verbose:
-                print(f"🔌 Connecting to MindsDB at {Config.MINDSDB_URL}")
-            self.connection = mindsdb_sdk.connect(**params)
-            if self.verbose:
-                print("✅ Connected to MindsDB successfully")
+        with self._pool_lock:
+            if not self.connection:
+                # Validate configuration first
+                if not Config.validate_mindsdb_config():
+                    raise ValueError("Invalid MindsDB configuration")
+                
+                params = Config.get_mindsdb_connection_params()
+                if self.verbose:
+                    print(f"🔌 Connecting to MindsDB at {Config.MINDSDB_URL}")
+                self.connection = mindsdb_sdk.connect(**params)
+                if self.verbose:
+                    print("✅ Connected to MindsDB successfully")
+                
+                # The primary connection is the first pooled one
+                self._pool.put(self.connection)
+                self._pool_created = 1
+    
+    @contextmanager
+    def borrow(self):
+        """Borrow a pooled MindsDB connection for the duration of a with-block"""
+        self.connect()
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = None
+            with self._pool_lock:
+                if self._pool_created < Config.MINDSDB_POOL_SIZE:
+                    self._pool_created += 1
+                    create = True
+                else:
+                    create = False
+            if create:
+                try:
+                    conn = mindsdb_sdk.connect(**Config.get_mindsdb_connection_params())
+                except Exception:
+                    with self._pool_lock:
+                        self._pool_created -= 1
+                    raise
+            else:
+                conn = self._pool.get()
+        try:
+            yield conn
+        finally:
+            self._pool.put(conn)
     
     def create_knowledge_base(self, csv_path: str = Config.METADATA_FILE) -> str:
         """Create MindsDB Knowledge Base from enriched metadata CSV"""
@@ -66,11 +113,10 @@ class VectorStore:
         if self.verbose:
             print(f"🔍 Searching for: {query}")
         
-        # Ensure we're connected before searching
-        self.connect()
-        
-        kb = self.connection.knowledge_bases.get(self.kb_name)
-        results = kb.find(query=query, limit=top_k).fetch()
+        # Borrowing connects on first use
+        with self.borrow() as conn:
+            kb = conn.knowledge_bases.get(self.kb_name)
+            results = kb.find(query=query, limit=top_k).fetch()
         # Format results as list of dicts
         return results.to_dict(orient='records')
     
@@ -141,9 +187,8 @@ class VectorStore:
                     print("No valid learnings data found")
                 return learnings_kb_name
             
-            # Create DataFrame
-            import pandas as pd
-            df = pd.DataFrame(learnings_data)
+            # Create DataFrame straight from the parsed records (kb.insert takes a DataFrame)
+            df = pd.DataFrame.from_records(learnings_data, columns=LEARNINGS_COLUMNS)
             
             # Drop existing learnings KB if it exists
             try:
@@ -184,11 +229,19 @@ class VectorStore:
         learnings_kb_name = f"{self.kb_name}_learnings"
         
         try:
-            self.connect()
-            kb = self.connection.knowledge_bases.get(learnings_kb_name)
-            results = kb.find(query=query, limit=top_k).fetch()
+            with self.borrow() as conn:
+                kb = conn.knowledge_bases.get(learnings_kb_name)
+                results = kb.find(query=query, limit=top_k).fetch()
             return results.to_dict(orient='records')
         except Exception as e:
             if self.verbose:
                 print(f"Warning: Could not search learnings KB: {e}")
-            return []
\ No newline at end of file
+            return []
+
+@lru_cache(maxsize=None)
+def get_vector_store() -> VectorStore:
+    """Process-wide VectorStore, so repeated lookups reuse its connection pool
+    
+    The store is shared: set its verbose attribute rather than expecting a fresh instance.
+    """
+    return VectorStore()
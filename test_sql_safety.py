@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+
+from src.sql_safety import static_safety_check
+
+def is_safe(sql):
+    verdict = static_safety_check(sql)
+    return None if verdict is None else verdict['is_safe']
+
+def test_plain_reads_are_safe():
+    assert is_safe("SELECT count() FROM orders") is True
+    assert is_safe("WITH t AS (SELECT 1) SELECT * FROM t;") is True
+    assert is_safe("DESCRIBE orders") is True
+    assert is_safe("SHOW CREATE TABLE orders") is True
+    assert is_safe("SELECT * FROM (SELECT id FROM users) LIMIT 5") is True
+
+def test_keywords_in_literals_and_comments_are_ignored():
+    assert is_safe("SELECT * FROM notes WHERE note = 'drop'") is True
+    assert is_safe("SELECT * FROM t WHERE s = 'it\\'s; DELETE'") is True
+    assert is_safe("SELECT 1 -- drop table t") is True
+    assert is_safe('SELECT * FROM notes WHERE name = "drop"') is True
+    assert is_safe("SELECT `delete`, \"it's\" FROM t") is True
+
+def test_writes_are_rejected():
+    assert is_safe("DROP TABLE orders") is False
+    assert is_safe("SELECT 1; DROP TABLE orders") is False
+    assert is_safe("CREATE TABLE t (x UInt8) ENGINE = Memory") is False
+    assert is_safe("SELECT * FROM t INTO OUTFILE '/tmp/x'") is False
+
+def test_table_functions_and_system_tables_need_review():
+    for sql in [
+        "SELECT * FROM file('/etc/passwd', 'LineAsString')",
+        "SELECT * FROM url('http://example.com/data.csv', CSV)",
+        "SELECT * FROM s3('https://bucket/key', 'CSV')",
+        "SELECT * FROM remote('other-host', db.t)",
+        "SELECT * FROM mysql('host:3306', 'db', 't', 'user', 'pass')",
+        "SELECT * FROM postgresql('host:5432', 'db', 't', 'user', 'pass')",
+        "SELECT * FROM executable('script.sh', TSV, 'x String')",
+        "SELECT * FROM orders o JOIN URL ('http://x', CSV) u ON o.id = u.id",
+        "SELECT file('/etc/passwd')",
+        "SELECT name FROM system.users",
+        'SELECT * FROM "system".users',
+        "SELECT * FROM `system`.`users`",
+        'SELECT * FROM "file"(\'/etc/passwd\', \'LineAsString\')',
+        "SELECT * FROM numbers(10)",
+    ]:
+        assert static_safety_check(sql) is None, sql
+
+def test_multiple_statements_need_review():
+    assert static_safety_check("SELECT 1; SELECT 2") is None
+
+if __name__ == "__main__":
+    for name, test in list(globals().items()):
+        if name.startswith("test_"):
+            test()
+    print("All SQL safety checks passed")
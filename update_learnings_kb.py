@@ -6,20 +6,23 @@ Run this periodically to keep the RAG system updated with latest learnings
 import sys
 import os
 
-# Add src directory to Python path
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'src'))
-
-from src.vector_store import VectorStore
+from src.vector_store import get_vector_store
+from src.learnings_index import LearningsIndex, SUCCESSFUL_QUERIES_FILE
 
 def main():
     """Update the learnings knowledge base"""
     print("🔄 Updating learnings knowledge base...")
     
     try:
-        vector_store = VectorStore(verbose=True)
+        vector_store = get_vector_store()
         vector_store.create_learnings_knowledge_base()
         print("✅ Learnings knowledge base updated successfully!")
         
+        # Prebuild the local learnings index so query processes load it instead of re-embedding
+        if os.path.exists(SUCCESSFUL_QUERIES_FILE):
+            LearningsIndex.create(SUCCESSFUL_QUERIES_FILE).save()
+            print("✅ Local learnings index saved")
+        
     except Exception as e:
         print(f"❌ Failed to update learnings KB: {e}")
         sys.exit(1)